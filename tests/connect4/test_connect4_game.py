@@ -1,3 +1,5 @@
+from textwrap import dedent
+
 import numpy as np
 import pytest
 
@@ -179,6 +181,41 @@ def test_make_move():
     assert display == expected_display
 
 
+def test_make_move_full_column():
+    board = Connect4State("""\
+...X...
+...O...
+...X...
+...O...
+...X...
+...O...
+""")
+    cursor = board.create_cursor()
+
+    with pytest.raises(ValueError, match=r'Column is full\.'):
+        board.make_move(3)
+    with pytest.raises(ValueError, match=r'Column is full\.'):
+        cursor.push(3)
+    assert cursor.depth == 0
+
+
+def test_make_moves_full_column():
+    board = Connect4State("""\
+...X...
+...O...
+...X...
+...O...
+...X...
+...O...
+""")
+    batch = board.create_batch([board, Connect4State()])
+
+    with pytest.raises(ValueError, match=r'Column is full\.'):
+        batch.make_moves([3, 3])
+    next_batch = batch.make_moves([2, 3])
+    assert next_batch.spaces[0, 0, 0, 3] == 1
+
+
 def test_make_move_o():
     text = """\
 .......
@@ -393,3 +430,115 @@ OXXO...
     valid_moves = board.get_valid_moves()
 
     assert not valid_moves.any()
+
+
+def test_zobrist_key_after_moves():
+    state = Connect4State()
+    for move in (3, 3, 2, 4, 3):
+        state = state.make_move(move)
+
+    assert state.zobrist_key == state.calculate_zobrist_key()
+    assert state == Connect4State(state.display())
+    assert hash(state) == hash(Connect4State(state.display()))
+
+
+def test_cursor_matches_make_move():
+    np.random.seed(0)
+    state = Connect4State()
+    cursor = state.create_cursor()
+    while not state.is_ended():
+        valid_moves = np.flatnonzero(state.get_valid_moves())
+        assert cursor.valid_moves() == valid_moves.tolist()
+        assert cursor.active_player() == state.get_active_player()
+        move = np.random.choice(valid_moves)
+        state = state.make_move(move)
+        cursor.push(move)
+
+    assert cursor.is_ended()
+    assert cursor.winner() == state.get_winner()
+    assert cursor.get_state() == state
+    for _ in range(cursor.depth):
+        cursor.pop()
+    assert cursor.get_state() == Connect4State()
+
+
+def test_column_bitboards():
+    state = Connect4State(dedent("""\
+        .......
+        .......
+        .......
+        .......
+        O......
+        X.....X
+        """))
+    column_size = 7  # One extra bit above each column
+
+    assert state.bitboards[0] == (1 << 0) | (1 << (6*column_size))
+    assert state.bitboards[1] == 1 << 1
+    assert state.rules.find_drop_bit(state.bitboards[0] | state.bitboards[1],
+                                     0) == 1 << 2
+
+
+@pytest.mark.parametrize('text,expected_winner', [
+    ("""\
+........
+........
+........
+........
+.......O
+.......O
+.......O
+XXX....O
+""", Connect4State.O_PLAYER),  # Vertical at the right edge
+    ("""\
+........
+........
+........
+........
+........
+X.......
+XO......
+XOOO...X
+""", Connect4State.NO_PLAYER),  # Lines don't wrap to the next column
+    ("""\
+........
+........
+........
+........
+...X....
+..XO....
+.XOO....
+XOOXX...
+""", Connect4State.X_PLAYER),
+    ("""\
+........
+........
+........
+........
+O.......
+XO......
+XXO.....
+XXXO....
+""", Connect4State.O_PLAYER),
+])
+def test_winner_bigger_board(text, expected_winner):
+    state = Connect4State(text, board_height=8, board_width=8)
+
+    assert state.get_winner() == expected_winner
+    assert state.display() == text
+
+
+def test_bigger_board_cursor_matches_make_move():
+    np.random.seed(0)
+    state = Connect4State(board_height=7, board_width=9)
+    cursor = state.create_cursor()
+    while not state.is_ended():
+        valid_moves = np.flatnonzero(state.get_valid_moves())
+        assert cursor.valid_moves() == valid_moves.tolist()
+        move = np.random.choice(valid_moves)
+        state = state.make_move(move)
+        cursor.push(move)
+
+    assert cursor.winner() == state.get_winner()
+    assert cursor.get_state() == state
+    assert state.zobrist_key == state.calculate_zobrist_key()
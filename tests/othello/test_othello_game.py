@@ -1,3 +1,4 @@
+from collections import Counter
 from textwrap import dedent
 
 import numpy as np
@@ -497,3 +498,179 @@ def test_equality():
         """))
 
     assert not state1 == state2
+
+
+def test_zobrist_key_after_flips_and_pass():
+    state = OthelloState(dedent("""\
+        ......
+        ......
+        X.....
+        .OO...
+        .OO...
+        ......
+        >O
+        """))
+    state = state.make_move(36)  # Pass
+    state = state.make_move(state.parse_move('6D'))  # Flips 4B and 5C
+
+    assert state.spaces[0].sum() == 4
+    assert state.zobrist_key == state.calculate_zobrist_key()
+    assert hash(state) == hash(OthelloState(state.display()))
+
+
+def test_cursor_matches_make_move():
+    np.random.seed(0)
+    state = OthelloState()
+    cursor = state.create_cursor()
+    while not state.is_ended():
+        valid_moves = np.flatnonzero(state.get_valid_moves())
+        assert list(cursor.valid_moves()) == valid_moves.tolist()
+        assert cursor.active_player() == state.get_active_player()
+        move = np.random.choice(valid_moves)
+        state = state.make_move(move)
+        cursor.push(move)
+
+    assert cursor.is_ended()
+    assert cursor.winner() == state.get_winner()
+    assert cursor.get_state() == state
+    for _ in range(cursor.depth):
+        cursor.pop()
+    assert cursor.get_state() == OthelloState()
+
+
+def count_positions(state: OthelloState, depth: int) -> int:
+    """ Count the move sequences of a given length, like chess perft.
+
+    A game that ends early counts as one sequence.
+    """
+    if depth == 0 or state.is_ended():
+        return 1
+    return sum(count_positions(state.make_move(move), depth - 1)
+               for move in np.flatnonzero(state.get_valid_moves()))
+
+
+def count_cursor_positions(cursor, depth: int) -> int:
+    if depth == 0 or cursor.is_ended():
+        return 1
+    total = 0
+    for move in cursor.valid_moves():
+        cursor.push(move)
+        total += count_cursor_positions(cursor, depth - 1)
+        cursor.pop()
+    return total
+
+
+# Counts from the original loop-based move generation.
+@pytest.mark.parametrize('board_size,expected_counts', [
+    (6, [4, 12, 56, 244, 1364, 7604]),
+    (8, [4, 12, 56, 244, 1396]),
+    (10, [4, 12, 56, 244]),
+])
+def test_perft(board_size, expected_counts):
+    state = OthelloState(board_height=board_size, board_width=board_size)
+    cursor = state.create_cursor()
+
+    counts = [count_positions(state, depth)
+              for depth in range(1, len(expected_counts) + 1)]
+    cursor_counts = [count_cursor_positions(cursor, depth)
+                     for depth in range(1, len(expected_counts) + 1)]
+
+    assert counts == expected_counts
+    assert cursor_counts == expected_counts
+
+
+def test_perft_with_pass():
+    state = OthelloState(dedent("""\
+        ......
+        ......
+        X.....
+        .OO...
+        .OO...
+        ......
+        >O
+        """))
+    expected_counts = [1, 1, 4, 8, 32]
+
+    counts = [count_positions(state, depth)
+              for depth in range(1, len(expected_counts) + 1)]
+
+    assert counts == expected_counts
+
+
+def test_ray_spaces():
+    rules = OthelloState(board_height=8, board_width=8).rules
+    directions = list(rules.DIRECTIONS)
+    padding = 64
+
+    # Space 3C is row 2, column 2.
+    down_right = rules.ray_spaces[18, directions.index((1, 1))]
+    up_left = rules.ray_spaces[18, directions.index((-1, -1))]
+
+    assert down_right.tolist() == [27, 36, 45, 54, 63, padding, padding, padding]
+    assert up_left.tolist() == [9, 0] + [padding] * 6
+    assert (rules.ray_spaces[padding] == padding).all()
+    assert rules is OthelloState(board_height=8, board_width=8).rules
+
+
+def test_status_with_moves():
+    state = OthelloState()
+    expected_move_spaces = sum(1 << state.parse_move(text)
+                               for text in ('2C', '3B', '4E', '5D'))
+
+    status = state.find_status()
+
+    assert status.move_spaces == expected_move_spaces
+    assert not status.is_pass_allowed
+    assert not status.is_ended
+    assert status.winner == state.NO_PLAYER
+
+
+def test_status_with_pass():
+    state = OthelloState(dedent("""\
+        ......
+        ......
+        X.....
+        .OO...
+        .OO...
+        ......
+        >O
+        """))
+
+    status = state.find_status()
+
+    assert status.move_spaces == 0
+    assert status.is_pass_allowed
+    assert not status.is_ended
+
+
+def test_status_ended():
+    state = OthelloState(dedent("""\
+        ......
+        ......
+        ......
+        X.....
+        .OO...
+        .OO...
+        >X
+        """))
+
+    status = state.find_status()
+
+    assert status.move_spaces == 0
+    assert not status.is_pass_allowed
+    assert status.is_ended
+    assert status.winner == state.O_PLAYER
+
+
+def test_status_calculated_once(monkeypatch):
+    monkeypatch.setattr(OthelloState, 'count_memos', True)
+    monkeypatch.setattr(OthelloState, 'memo_hits', Counter())
+    monkeypatch.setattr(OthelloState, 'memo_misses', Counter())
+    state = OthelloState().make_move(19)
+
+    state.get_valid_moves()
+    state.is_ended()
+    state.get_winner()
+
+    assert OthelloState.memo_misses['find_status'] == 1
+    assert OthelloState.memo_hits['find_status'] == 2
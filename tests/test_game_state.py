@@ -0,0 +1,405 @@
+import pickle
+import typing
+from textwrap import dedent
+
+import numpy as np
+import pytest
+
+from zero_play.connect4.game import Connect4State
+from zero_play.game_state import (GridGameState, StateBatch, LineRules,
+                                  Transition, BitboardGameState, GridGeometry)
+from zero_play.othello.game import OthelloState
+from zero_play.tictactoe.state import (TicTacToeState, FiveInARowState,
+                                       TicTacToeTableState)
+
+
+class RowState(GridGameState):
+    """ Third-party style game: fill a row of three to win. """
+    game_name = 'Row'
+
+    def __init__(self,
+                 text: str | None = None,
+                 spaces: np.ndarray | None = None,
+                 board_height: int = 3,
+                 board_width: int = 3):
+        super().__init__(board_height=board_height,
+                         board_width=board_width,
+                         text=text,
+                         spaces=spaces)
+
+    def is_win(self, player: int) -> bool:
+        piece_type = self.piece_types.index(player)
+        return bool(self.spaces[piece_type].all(axis=1).any())
+
+
+def play_random_states(start_state,
+                       state_count: int) -> typing.List[GridGameState]:
+    states = []
+    while len(states) < state_count:
+        state = start_state
+        while not state.is_ended():
+            states.append(state)
+            state = state.make_move(
+                np.random.choice(np.flatnonzero(state.get_valid_moves())))
+        states.append(state)
+    return states[:state_count]
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         Connect4State(),
+                                         OthelloState(),
+                                         OthelloState(board_height=8,
+                                                      board_width=8),
+                                         OthelloState(board_height=10,
+                                                      board_width=8),
+                                         FiveInARowState(),
+                                         RowState()])
+def test_batch_matches_states(start_state):
+    np.random.seed(0)
+    states = play_random_states(start_state, 60)
+    live_states = [state for state in states if not state.is_ended()]
+    moves = [np.random.choice(np.flatnonzero(state.get_valid_moves()))
+             for state in live_states]
+
+    batch = start_state.create_batch(states)
+    next_batch = start_state.create_batch(live_states).make_moves(moves)
+
+    assert batch.spaces.shape == (60,) + start_state.spaces.shape
+    assert batch.valid_moves().tolist() == [
+        state.get_valid_moves().tolist() for state in states]
+    assert batch.winners().tolist() == [state.get_winner() for state in states]
+    assert batch.active_players().tolist() == [
+        state.get_active_player() for state in states]
+    assert batch.is_ended().tolist() == [state.is_ended() for state in states]
+    assert [next_batch.get_state(i) for i in range(len(next_batch))] == [
+        state.make_move(move) for state, move in zip(live_states, moves)]
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         TicTacToeTableState(),
+                                         Connect4State(),
+                                         OthelloState(),
+                                         OthelloState(board_height=10,
+                                                      board_width=8),
+                                         FiveInARowState(),
+                                         RowState()])
+def test_bytes_round_trip(start_state):
+    np.random.seed(0)
+    states = play_random_states(start_state, 30)
+
+    byte_strings = [state.to_bytes() for state in states]
+    restored_states = [start_state.from_bytes(data) for data in byte_strings]
+    packed = start_state.pack_many(states)
+    unpacked_states = start_state.unpack_many(packed)
+
+    assert {len(data) for data in byte_strings} == {start_state.byte_count}
+    assert restored_states == states
+    assert [state.get_active_player() for state in restored_states] == [
+        state.get_active_player() for state in states]
+    assert [state.get_winner() for state in restored_states] == [
+        state.get_winner() for state in states]
+    assert packed.shape == (30, start_state.byte_count)
+    assert [row.tobytes() for row in packed] == byte_strings
+    assert unpacked_states == states
+
+
+def test_bytes_size():
+    state = Connect4State()
+
+    with pytest.raises(ValueError,
+                       match=r'Expected 15 bytes, but found 5\.'):
+        state.from_bytes(TicTacToeState().to_bytes())
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         TicTacToeTableState(),
+                                         Connect4State(),
+                                         OthelloState(),
+                                         FiveInARowState(),
+                                         RowState()])
+def test_valid_move_indices(start_state):
+    np.random.seed(0)
+    states = play_random_states(start_state, 60)
+
+    assert [state.get_valid_move_indices().tolist() for state in states] == [
+        np.flatnonzero(state.get_valid_moves()).tolist() for state in states]
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         TicTacToeTableState(),
+                                         Connect4State(),
+                                         OthelloState(),
+                                         FiveInARowState(),
+                                         RowState()])
+def test_step_matches_state(start_state):
+    np.random.seed(0)
+    states = [state
+              for state in play_random_states(start_state, 60)
+              if not state.is_ended()]
+    moves = [np.random.choice(state.get_valid_move_indices())
+             for state in states]
+
+    transitions = [state.step(move) for state, move in zip(states, moves)]
+    expected_states = [state.make_move(move)
+                       for state, move in zip(states, moves)]
+
+    assert [transition.state for transition in transitions] == expected_states
+    for transition, expected_state in zip(transitions, expected_states):
+        expected_transition = Transition.from_state(
+            start_state.from_bytes(expected_state.to_bytes()))
+        assert transition.is_ended == expected_transition.is_ended
+        assert transition.winner == expected_transition.winner
+        assert transition.active_player == expected_transition.active_player
+        assert (transition.move_indices.tolist() ==
+                expected_transition.move_indices.tolist())
+
+
+def test_othello_pass_move_index():
+    state = OthelloState("""\
+......
+......
+......
+......
+....O.
+...XX.
+>O
+""")
+
+    assert state.get_valid_move_indices().tolist() == [36]
+
+
+def test_generic_batch():
+    batch = RowState().create_batch([RowState()])
+
+    assert isinstance(batch, StateBatch)
+
+
+def test_line_rules_count():
+    line_rules = LineRules.get(15, 15, 5)
+    across_count = 15 * 11
+    diagonal_count = 11 * 11
+
+    assert len(line_rules.lines) == 2*across_count + 2*diagonal_count
+    assert line_rules.line_spaces.shape == (len(line_rules.lines), 5)
+    assert line_rules is LineRules.get(15, 15, 5)
+
+
+@pytest.mark.parametrize('row_stride,column_stride', [(None, 1),
+                                                      (-1, 8)])
+def test_line_rules_match_line_spaces(row_stride, column_stride):
+    """ Shift checks on bitboards agree with checks on spaces arrays. """
+    np.random.seed(0)
+    line_rules = LineRules(7, 9, 4, row_stride, column_stride)
+    for _ in range(200):
+        spaces = np.random.rand(7*9) < 0.4
+        bits = sum(1 << int(bit)
+                   for bit in line_rules.space_bits[spaces])
+        expected_has_line = spaces[line_rules.line_spaces].all(axis=1).any()
+
+        assert line_rules.has_line(bits) == expected_has_line
+        if expected_has_line:
+            space = line_rules.line_spaces[
+                spaces[line_rules.line_spaces].all(axis=1).argmax(), 2]
+            assert line_rules.has_line_through(bits, space)
+
+
+def test_five_in_a_row():
+    state = FiveInARowState(board_height=6, board_width=6)
+    for move in (0, 6, 7, 12, 14, 18, 21, 24):
+        assert state.get_winner() == state.NO_PLAYER
+        state = state.make_move(move)
+
+    state = state.make_move(28)  # Fifth X on the diagonal
+
+    assert state.get_winner() == state.X_PLAYER
+    assert FiveInARowState(state.display(),
+                           board_height=6,
+                           board_width=6).get_winner() == state.X_PLAYER
+
+
+@pytest.mark.parametrize('start_state,expected_count', [
+    (TicTacToeState(), 8),
+    (TicTacToeState(board_height=3, board_width=4), 4),
+    (Connect4State(), 2),
+    (OthelloState(), 8),
+    (RowState(), 1),
+])
+def test_symmetry_count(start_state, expected_count):
+    symmetries = start_state.get_symmetries()
+
+    assert len(symmetries) == expected_count
+    assert symmetries[0].is_identity
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         Connect4State(),
+                                         OthelloState()])
+def test_symmetric_moves(start_state):
+    """ Moves in a transformed position match moves in the original. """
+    np.random.seed(0)
+    for state in play_random_states(start_state, 20):
+        valid_moves = state.get_valid_moves()
+        for symmetry in state.get_symmetries():
+            transformed = state.transform(symmetry)
+            assert np.array_equal(transformed.get_valid_moves(),
+                                  symmetry.transform_move_values(valid_moves))
+            for move in np.flatnonzero(valid_moves):
+                new_move = symmetry.transform_move(move)
+                assert symmetry.restore_move(new_move) == move
+                assert (transformed.make_move(new_move) ==
+                        state.make_move(move).transform(symmetry))
+
+
+def test_find_canonical():
+    state = TicTacToeState().make_move(0).make_move(5)
+    canonical_states = set()
+    for symmetry in state.get_symmetries():
+        canonical_state, _ = state.transform(
+            symmetry).find_canonical()
+        canonical_states.add(canonical_state)
+
+    assert len(canonical_states) == 1
+
+
+def test_opening_positions_merge():
+    start_state = TicTacToeState()
+    states = [start_state.make_move(move1).make_move(move2)
+              for move1 in range(9)
+              for move2 in range(9)
+              if move1 != move2]
+
+    canonical_states = {state.find_canonical()[0] for state in states}
+
+    assert len(set(states)) == 72
+    assert len(canonical_states) == 12
+
+
+def test_othello_pass_symmetry():
+    state = OthelloState()
+    pass_move = state.board_height * state.board_width
+
+    for symmetry in state.get_symmetries():
+        assert symmetry.transform_move(pass_move) == pass_move
+
+
+def test_memo_counts_per_class(monkeypatch):
+    monkeypatch.setattr(GridGameState, 'count_memos', True)
+    TicTacToeState.clear_memo_counts()
+    OthelloState.clear_memo_counts()
+    tictactoe_state = TicTacToeState()
+    othello_state = OthelloState()
+    tictactoe_state.get_winner()
+    tictactoe_state.get_winner()
+    othello_state.get_winner()
+
+    assert TicTacToeState.get_memo_hit_rates() == {'get_winner': 0.5}
+    assert OthelloState.memo_hits['get_winner'] == 0
+
+    OthelloState.clear_memo_counts()
+
+    assert TicTacToeState.get_memo_hit_rates() == {'get_winner': 0.5}
+    assert OthelloState.get_memo_hit_rates() == {}
+    assert GridGameState.memo_hits is not TicTacToeState.memo_hits
+
+
+def test_memo_counts_off_by_default():
+    TicTacToeState.clear_memo_counts()
+    state = TicTacToeState()
+    state.get_winner()
+    state.get_winner()
+
+    assert TicTacToeState.get_memo_hit_rates() == {}
+
+
+def test_grid_geometry_shared():
+    geometry = Connect4State().geometry
+
+    assert GridGeometry.get(6, 7, 2) is geometry
+    assert GridGeometry.get(7, 6, 2) is not geometry
+    assert geometry.space_count == 42
+    assert geometry.full_mask == (1 << 42) - 1
+    assert pickle.loads(pickle.dumps(geometry)) is geometry
+
+
+@pytest.mark.parametrize('start_state', [TicTacToeState(),
+                                         Connect4State(),
+                                         OthelloState(board_height=10,
+                                                      board_width=8),
+                                         RowState()])
+def test_pack_spaces_round_trip(start_state):
+    np.random.seed(0)
+    pieces = np.random.randint(3, size=start_state.spaces.shape[1:])
+    spaces = np.stack([pieces == piece_type + 1
+                       for piece_type in range(len(start_state.piece_types))])
+    spaces = spaces.astype(np.uint8)
+
+    start_state.pack_spaces(spaces)
+    unpacked = start_state.unpack_spaces()
+
+    assert unpacked.shape == spaces.shape
+    assert np.array_equal(unpacked, spaces)
+
+
+def test_bitboard_layout():
+    state = OthelloState(dedent("""\
+        ......
+        ......
+        ......
+        ......
+        ..O...
+        .X....
+        >X
+        """))
+
+    assert isinstance(state, BitboardGameState)
+    assert state.bitboards == (1 << (5*6 + 1), 1 << (4*6 + 2))
+    assert state.bits_to_array(state.bitboards[1]).nonzero()[0].tolist() == [
+        4*6 + 2]
+
+
+def test_bitboard_spaces_not_cached():
+    state = Connect4State().make_move(3)
+
+    spaces = state.spaces
+
+    assert spaces[0, 5, 3] == 1
+    assert not spaces.flags.writeable
+    assert state.spaces is not spaces
+    assert RowState.cache_spaces
+
+
+def test_with_bitboards():
+    state = TicTacToeState()
+
+    new_state = state.with_bitboards((0b1, 0b10))
+
+    assert state.bitboards == (0, 0)
+    assert state.get_move_count() == 0
+    assert new_state.display() == dedent("""\
+        XO.
+        ...
+        ...
+        """)
+    assert new_state.get_move_count() == 2
+    assert new_state.zobrist_key != state.zobrist_key
+    assert new_state == TicTacToeState(new_state.display())
+
+
+def test_bitboard_equality():
+    text = dedent("""\
+        .......
+        .......
+        .......
+        .......
+        ...O...
+        ..XX...
+        """)
+    text_state = Connect4State(text)
+    spaces_state = Connect4State(spaces=text_state.get_spaces().copy())
+    played_state = Connect4State().make_move(3).make_move(3).make_move(2)
+    other_state = Connect4State().make_move(3).make_move(2).make_move(2)
+
+    assert text_state == spaces_state == played_state
+    assert hash(text_state) == hash(spaces_state) == hash(played_state)
+    assert text_state != other_state
+    assert len({text_state, spaces_state, played_state, other_state}) == 2
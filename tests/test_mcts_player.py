@@ -1,15 +1,19 @@
+import sys
 import typing
 from collections import Counter
 
 import numpy as np
-from pytest import approx
+import pytest
+from pytest import approx, raises
 
 from zero_play.connect4.game import Connect4State
 from zero_play.game_state import GameState
 from zero_play.heuristic import Heuristic
-from zero_play.mcts_player import SearchNode, MctsPlayer, SearchManager
+from zero_play.mcts_player import (SearchNode, MctsPlayer, SearchManager,
+                                   SearchTree)
 from zero_play.playout import Playout
 from zero_play.tictactoe.state import TicTacToeState
+from tests.test_playout import TakeOneTwiceGame
 
 
 class FirstChoiceHeuristic(Heuristic):
@@ -196,6 +200,82 @@ XXO
     assert leaf3 == expected_leaf
 
 
+def test_select_deep_leaf():
+    """ Deeper than the recursion limit, like a long game. """
+    board = TicTacToeState()
+    nodes = [SearchNode(board)]
+    for _ in range(sys.getrecursionlimit()):
+        parent = nodes[-1]
+        parent.value_count = 1
+        child = SearchNode(board, parent, move=0)
+        parent.children = [child]
+        nodes.append(child)
+
+    leaf = nodes[0].select_leaf()
+    leaf.record_value(1)
+
+    assert leaf is nodes[-1]
+    assert nodes[0].value_count == 2
+
+
+def test_select_ties_at_random(monkeypatch):
+    start_state = TicTacToeState()
+    chosen_moves = []
+    for _ in range(2):
+        monkeypatch.setattr(SearchNode,
+                            'tie_generator',
+                            np.random.default_rng(0))
+        node = SearchNode(start_state)
+        node.record_value(0)
+        moves = []
+        for _ in range(3):
+            leaf = node.select_leaf()
+            leaf.record_value(0)
+            moves.append(leaf.move)
+        chosen_moves.append(moves)
+
+    assert chosen_moves[0] == chosen_moves[1]
+    assert chosen_moves[0] != [0, 1, 2]
+    assert len(set(chosen_moves[0])) == 3
+
+
+def test_select_after_exploration_weight_changes(monkeypatch):
+    start_state = TicTacToeState()
+    node = SearchNode(start_state)
+    node.select_leaf().record_value(0)
+    node.select_leaf().record_value(0)
+    node.select_leaf().record_value(-1)  # Move 1 is a win.
+    expected_leaf = SearchNode(start_state.make_move(2))
+    node.select_leaf()  # Priors are cached for the old weight.
+
+    monkeypatch.setattr(SearchNode, 'exploration_weight', 100.0)
+    leaf = node.select_leaf()
+
+    assert leaf == expected_leaf
+
+
+def test_children_created_when_selected():
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state, Playout())
+    node = manager.current_node
+    node.record_value(0)
+    leaf = node.select_leaf()
+    leaf.record_value(1)
+
+    move_probabilities = manager.get_move_probabilities(start_state)
+    created_children = node.children
+    best_children = node.find_best_children()
+
+    assert created_children == [leaf]
+    assert len(move_probabilities) == 9
+    assert move_probabilities[0][2:] == (1, -1.0)
+    assert [value_count for _, _, value_count, _ in move_probabilities] == [
+        1, 0, 0, 0, 0, 0, 0, 0, 0]
+    assert [child.move for child in best_children] == list(range(1, 9))
+    assert len(node.children) == 9
+    assert all(child.value_count == 0 for child in best_children)
+
+
 def test_choose_move():
     np.random.seed(0)
     start_state = Connect4State()
@@ -322,6 +402,70 @@ def test_search_manager_reuses_node():
     assert first_value_count + 10 == second_value_count
 
 
+@pytest.mark.parametrize('use_array_tree', [False, True])
+def test_search_manager_reuses_grandchild(use_array_tree):
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state,
+                            Playout(),
+                            use_array_tree=use_array_tree)
+    manager.search(start_state, iterations=100)
+    child = max(manager.current_node.children,
+                key=lambda node: node.value_count)
+    grandchild = max(child.children, key=lambda node: node.value_count)
+    state2 = grandchild.game_state
+    first_value_count = grandchild.value_count
+
+    manager.search(state2, iterations=10)
+    node = manager.current_node
+
+    assert node.game_state == state2
+    assert node.parent is None
+    assert manager.inherited_visits == first_value_count > 0
+    assert node.value_count == first_value_count + 10
+    assert manager.average_inherited_visits == first_value_count / 2
+
+
+@pytest.mark.parametrize('use_array_tree', [False, True])
+def test_search_manager_steps_back(use_array_tree):
+    """ The old root was released, so search again from a new one. """
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state,
+                            Playout(),
+                            use_array_tree=use_array_tree)
+    state1 = start_state.make_move(4)
+    manager.search(start_state, iterations=100)
+    manager.search(state1, iterations=100)
+
+    manager.search(start_state, iterations=10)
+    node = manager.current_node
+
+    assert node.game_state == start_state
+    assert node.parent is None
+    assert manager.inherited_visits == 0
+    assert node.value_count == 10
+
+
+@pytest.mark.parametrize('use_array_tree', [False, True])
+def test_search_manager_releases_old_nodes(use_array_tree):
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state,
+                            Playout(),
+                            use_array_tree=use_array_tree)
+    states = [start_state]
+    for move in (4, 0, 8):
+        states.append(states[-1].make_move(move))
+    for state in states:
+        manager.search(state, iterations=100)
+    node3 = manager.current_node
+
+    assert node3.game_state == states[3]
+    assert node3.parent is None
+    assert manager.node_count < 100  # Less than the last search added.
+
+
 def test_search_manager_with_opponent():
     """ Like when opponent is not sharing the SearchManager. """
     start_state = TicTacToeState()
@@ -449,3 +593,222 @@ XOXOXOX
 
     assert current_node1.game_state == state2
     assert current_node2.game_state == state3
+
+
+def play_search_game(manager: SearchManager, iterations: int):
+    """ Play a game with the manager choosing both sides' moves.
+
+    :return: [[(move, value_count, average_value)]] for the children of each
+        position that was searched
+    """
+    np.random.seed(0)
+    game_state = manager.start_state
+    all_stats = []
+    while not game_state.is_ended():
+        manager.search(game_state, iterations)
+        all_stats.append([(child.move, child.value_count, child.average_value)
+                          for child in manager.current_node.children])
+        if len(all_stats) < 4:
+            move = manager.choose_weighted_move()
+        else:
+            move = manager.get_best_move()
+        game_state = game_state.make_move(move)
+    return all_stats
+
+
+def test_array_tree_matches_objects():
+    start_state = Connect4State()
+    object_manager = SearchManager(start_state, Playout())
+    array_manager = SearchManager(start_state, Playout(), use_array_tree=True)
+
+    expected_stats = play_search_game(object_manager, iterations=100)
+    stats = play_search_game(array_manager, iterations=100)
+
+    assert stats == expected_stats
+
+
+def test_array_tree_grows():
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    tree = SearchTree(capacity=1)
+    manager = SearchManager(start_state, Playout(), use_array_tree=True)
+    manager.tree = tree
+    manager.reset()
+
+    manager.search(start_state, iterations=20)
+    root = manager.current_node
+
+    node_count = 0
+    pending_nodes = [root]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        node_count += 1
+        pending_nodes.extend(node.children or ())
+    assert len(tree) == node_count
+    assert tree.capacity == 64
+    assert root.value_count == 20
+    assert sum(child.value_count for child in root.children) == 19
+
+
+def test_transpositions_share_nodes():
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state, Playout(), use_transpositions=True)
+    root = manager.current_node
+    root.expand()
+    child0 = root.get_child(0)
+    child2 = root.get_child(2)
+    child0.expand()
+    child2.expand()
+    grandchild01 = child0.get_child(0)  # O at 1 after X at 0
+    grandchild21 = child2.get_child(1)  # O at 1 after X at 2
+    grandchild01.expand()
+    grandchild21.expand()
+
+    node012 = grandchild01.get_child(0)  # X at 2
+    node210 = grandchild21.get_child(0)  # X at 0
+
+    assert node012 is node210
+    assert node012.parent is grandchild01
+    assert manager.transpositions is not None
+    assert manager.transpositions.hit_count == 1
+    assert manager.transpositions.merge_rate == approx(1/6)
+
+    manager.current_node = grandchild21
+    move = manager.move_to_child(0)
+
+    assert move == 0
+    assert node210.move == 2  # From the parent that created it
+    assert manager.current_node is node210
+
+
+def test_transposition_values_follow_path():
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state, Playout(), use_transpositions=True)
+
+    manager.search(start_state, iterations=300)
+
+    nodes = {}
+    pending_nodes = [manager.current_node]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        if id(node) not in nodes:
+            nodes[id(node)] = node
+            pending_nodes.extend(node.children or ())
+    assert manager.transpositions is not None
+    assert manager.transpositions.hit_count > 0
+    # Each visit evaluates a node once, then passes through to a child.
+    for node in nodes.values():
+        if node.child_moves is not None and len(node.child_moves):
+            assert node.value_count == 1 + node.child_value_counts.sum()
+
+
+def test_transpositions_need_hashable_states():
+    with raises(ValueError,
+                match=r'Transpositions need hashable game states, but '
+                      r'TakeOneTwiceGame has no __hash__\(\)\.'):
+        SearchManager(TakeOneTwiceGame(5),
+                      Playout(),
+                      use_transpositions=True)
+
+
+def test_transpositions_need_objects():
+    with raises(ValueError, match='Transpositions need SearchNode objects'):
+        SearchManager(TicTacToeState(),
+                      Playout(),
+                      use_array_tree=True,
+                      use_transpositions=True)
+
+
+def test_evict_nodes():
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state, Playout(), max_nodes=20)
+    root = manager.current_node
+
+    manager.search(start_state, iterations=200)
+    nodes, _ = manager.find_all_nodes()
+
+    assert manager.node_count == len(nodes) <= 20
+    assert manager.eviction_count > 1
+    assert manager.evicted_node_count > 0
+    assert root.value_count == 200
+    assert root.child_value_counts.sum() == 199
+
+    manager.search(start_state, iterations=100)
+
+    assert manager.node_count <= 20
+    assert root.value_count == 300
+    assert root.child_value_counts.sum() == 299
+
+
+@pytest.mark.parametrize('use_array_tree', [False, True])
+def test_node_count_without_limit(use_array_tree):
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state,
+                            Playout(),
+                            use_array_tree=use_array_tree)
+
+    manager.search(start_state, iterations=20)
+
+    node_count = 0
+    pending_nodes = [manager.current_node]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        node_count += 1
+        pending_nodes.extend(node.children or ())
+    assert manager.node_count == node_count > 1
+
+
+def test_evicted_child_keeps_stats():
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    manager = SearchManager(start_state, Playout(), max_nodes=1)
+    root = manager.current_node
+    manager.search(start_state, iterations=30)
+    child_index = int(root.child_value_counts.argmax())
+    expected_count = root.child_value_counts[child_index]
+    expected_value = root.child_average_values[child_index]
+
+    child = root.get_child(child_index)
+
+    assert root.children == [child]
+    assert child.children is None
+    assert child.value_count == expected_count
+    assert child.average_value == expected_value
+    assert child.is_rebuilt
+    assert child.select_leaf() is child
+
+    child.evaluate(Playout())
+
+    assert not child.is_rebuilt
+    assert child.child_predictions is not None
+    assert child.value_count == expected_count + 1
+
+
+def test_node_limit_during_search():
+    np.random.seed(0)
+    start_state = TicTacToeState()
+    node_counts = []
+
+    class CountingPlayout(Playout):
+        def analyse(self, board: GameState):
+            node_counts.append(manager.node_count)
+            return super().analyse(board)
+
+    manager = SearchManager(start_state, CountingPlayout(), max_nodes=20)
+    manager.search(start_state, iterations=200)
+
+    # A new leaf can only be evicted after its evaluation.
+    assert max(node_counts) == 21
+    assert manager.node_count <= 20
+    assert manager.node_count_bound == manager.node_count
+
+
+def test_node_limit_needs_objects():
+    with raises(ValueError, match='Node limits need SearchNode objects'):
+        SearchManager(TicTacToeState(),
+                      Playout(),
+                      use_array_tree=True,
+                      max_nodes=100)
@@ -157,3 +157,19 @@ def test_long_simulation():
     value = playout.simulate(start_state)
 
     assert value == 1
+
+
+def test_generic_cursor():
+    start_state = TakeOneTwiceGame(3)
+    cursor = start_state.create_cursor()
+
+    cursor.push(1)
+    cursor.push(0)
+    is_ended = cursor.is_ended()
+    winner = cursor.winner()
+    cursor.pop()
+
+    assert is_ended
+    assert winner == start_state.X_PLAYER
+    assert cursor.get_state() == TakeOneTwiceGame(1, 1)
+    assert cursor.valid_moves() == [0]
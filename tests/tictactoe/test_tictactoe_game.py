@@ -1,9 +1,11 @@
+from collections import Counter
 from textwrap import dedent
 
 import numpy as np
 import pytest
 
-from zero_play.tictactoe.state import TicTacToeState
+from zero_play.tictactoe.state import (TicTacToeState, TicTacToeTable,
+                                      TicTacToeTableState)
 
 
 def test_create_board():
@@ -311,3 +313,307 @@ XOX
     is_ended = board.is_ended()
 
     assert is_ended == expected_is_ended
+
+
+def test_spaces_shared_and_read_only(monkeypatch):
+    monkeypatch.setattr(TicTacToeState, 'cache_spaces', True)
+    board = TicTacToeState(dedent("""\
+        X..
+        .O.
+        ...
+        """))
+
+    spaces1 = board.spaces
+    spaces2 = board.spaces
+
+    assert spaces1 is spaces2
+    with pytest.raises(ValueError):
+        spaces1[0, 2, 2] = 1
+
+
+def test_mutable_spaces():
+    text = dedent("""\
+        X..
+        .O.
+        ...
+        """)
+    expected_display = text
+    board = TicTacToeState(text)
+
+    spaces = board.mutable_spaces()
+    spaces[0, 2, 2] = 1
+
+    assert board.display() == expected_display
+    assert spaces[0, 2, 2] == 1
+
+
+def test_spaces_not_cached(monkeypatch):
+    monkeypatch.setattr(TicTacToeState, 'cache_spaces', False)
+    board = TicTacToeState()
+
+    spaces1 = board.spaces
+    spaces2 = board.spaces
+
+    assert spaces1 is not spaces2
+    assert np.array_equal(spaces1, spaces2)
+
+
+def test_zobrist_keys_unique_for_reachable_states():
+    start_state = TicTacToeState()
+    keys = {}  # {zobrist_key: state}
+    pending = [start_state]
+    while pending:
+        state = pending.pop()
+        known_state = keys.setdefault(state.zobrist_key, state)
+        assert known_state == state  # No collisions
+        if known_state is not state:
+            continue
+        assert state.zobrist_key == state.calculate_zobrist_key()
+        if state.is_ended():
+            continue
+        for move in np.flatnonzero(state.get_valid_moves()):
+            pending.append(state.make_move(move))
+
+    assert len(keys) == 5478
+
+
+def test_hash():
+    state1 = TicTacToeState().make_move(0).make_move(4)
+    state2 = TicTacToeState(dedent("""\
+        X..
+        .O.
+        ...
+        """))
+
+    assert state1 == state2
+    assert hash(state1) == hash(state2)
+    assert {state1: 'found'}[state2] == 'found'
+
+
+def test_slots():
+    state = TicTacToeState()
+
+    assert not hasattr(state, '__dict__')
+    assert state.geometry is TicTacToeState().geometry
+
+
+def test_intern_transposed_states(monkeypatch):
+    monkeypatch.setattr(TicTacToeState, 'intern_states', True)
+    start_state = TicTacToeState()
+
+    state1 = start_state.make_move(0).make_move(4).make_move(8)
+    state2 = start_state.make_move(8).make_move(4).make_move(0)
+
+    assert state1 is state2
+
+
+def test_no_interning_by_default():
+    start_state = TicTacToeState()
+
+    state1 = start_state.make_move(0).make_move(4).make_move(8)
+    state2 = start_state.make_move(8).make_move(4).make_move(0)
+
+    assert state1 == state2
+    assert state1 is not state2
+
+
+def test_cursor_push_and_pop():
+    start_state = TicTacToeState(dedent("""\
+        X..
+        .O.
+        ...
+        """))
+    expected_state = start_state.make_move(2).make_move(8)
+    cursor = start_state.create_cursor()
+
+    cursor.push(2)
+    cursor.push(8)
+    state = cursor.get_state()
+    cursor.pop()
+    cursor.pop()
+
+    assert state == expected_state
+    assert cursor.get_state() == start_state
+    assert cursor.depth == 0
+
+
+def test_cursor_winner():
+    cursor = TicTacToeState(dedent("""\
+        XX.
+        OO.
+        ...
+        """)).create_cursor()
+
+    cursor.push(2)
+
+    assert cursor.winner() == TicTacToeState.X_PLAYER
+    assert cursor.is_ended()
+    assert cursor.active_player() == TicTacToeState.O_PLAYER
+
+
+def test_memoized_results(monkeypatch):
+    monkeypatch.setattr(TicTacToeState, 'count_memos', True)
+    monkeypatch.setattr(TicTacToeState, 'memo_hits', Counter())
+    monkeypatch.setattr(TicTacToeState, 'memo_misses', Counter())
+    state = TicTacToeState(dedent("""\
+        XXX
+        OO.
+        ...
+        """))
+
+    winner1 = state.get_winner()
+    winner2 = state.get_winner()
+    valid_moves = state.get_valid_moves()
+
+    assert winner1 == winner2 == TicTacToeState.X_PLAYER
+    assert TicTacToeState.get_memo_hit_rates()['get_winner'] == 0.5
+    with pytest.raises(ValueError):
+        valid_moves[0] = True
+
+
+def test_clear_memos():
+    state = TicTacToeState()
+    assert state.get_move_count() == 0
+
+    state.bitboards = (1, 0)  # Not the usual way, so must clear memos.
+    state.clear_memos()
+
+    assert state.get_move_count() == 1
+
+
+def test_winner_from_last_move(monkeypatch):
+    state = TicTacToeState(dedent("""\
+        XX.
+        OO.
+        ...
+        """))
+    assert state.get_winner() == TicTacToeState.NO_PLAYER
+
+    def fail_scan(*_):
+        raise AssertionError('Scanned whole board.')
+    monkeypatch.setattr(TicTacToeState, 'is_win', fail_scan)
+    state2 = state.make_move(2)
+    state3 = state2.make_move(5)
+
+    assert state2.last_space == 2
+    assert state2.get_winner() == TicTacToeState.X_PLAYER
+    assert state3.get_winner() == TicTacToeState.X_PLAYER  # Still won.
+
+
+def test_winner_after_win_matches_scan():
+    """ X_PLAYER wins when both have a line, whichever line came first. """
+    state = TicTacToeState(dedent("""\
+        XX.
+        OOO
+        X..
+        """))
+    expected_state = TicTacToeState(dedent("""\
+        XXX
+        OOO
+        X..
+        """))
+    assert state.get_winner() == TicTacToeState.O_PLAYER
+
+    state2 = state.make_move(2)
+    cursor = state.create_cursor()
+    cursor.push(2)
+
+    assert expected_state.get_winner() == TicTacToeState.X_PLAYER
+    assert state2.get_winner() == TicTacToeState.X_PLAYER
+    assert cursor.winner() == TicTacToeState.X_PLAYER
+
+
+def test_space_lines():
+    lines = TicTacToeState().line_rules.space_lines
+
+    assert len(lines[4]) == 4  # Center has row, column, and both diagonals.
+    assert len(lines[1]) == 2  # Top middle has row and column.
+    assert all(line & (1 << 1) for line in lines[1])
+
+
+def test_table_positions():
+    table = TicTacToeTable.get()
+    game_indexes = set()
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        if index in game_indexes:
+            continue
+        game_indexes.add(index)
+        if not table.is_ended[index]:
+            pending.extend(table.successors[index][table.valid_moves[index]])
+
+    assert len(game_indexes) == 5478
+    assert len(table) > len(game_indexes)  # Also has moves after a win.
+
+
+def test_table_matches_state():
+    table = TicTacToeTable.get()
+    for index in range(len(table)):
+        table_state = table.get_state(index)
+        state = TicTacToeState(table_state.display())
+
+        assert table_state == state
+        assert table_state.get_winner() == state.get_winner()
+        assert table_state.is_ended() == state.is_ended()
+        assert table_state.get_active_player() == state.get_active_player()
+        assert np.array_equal(table_state.get_valid_moves(),
+                              state.get_valid_moves())
+        assert table_state.zobrist_key == state.zobrist_key
+
+
+def test_table_state_make_move():
+    start_state = TicTacToeTableState()
+    expected_display = dedent("""\
+        X..
+        .O.
+        ...
+        """)
+
+    state1 = start_state.make_move(0).make_move(4)
+    state2 = TicTacToeTableState(expected_display)
+
+    assert state1.display() == expected_display
+    assert state1 is start_state.make_move(0).make_move(4)
+    assert state2.index == state1.index
+    with pytest.raises(ValueError, match=r'Invalid move: 0\.'):
+        state1.make_move(0)
+
+
+def test_table_state_not_reachable():
+    with pytest.raises(ValueError, match=r'Position is not reachable\.'):
+        TicTacToeTableState(dedent("""\
+            XXX
+            X..
+            ...
+            """))
+
+
+def test_table_cursor():
+    start_state = TicTacToeTableState(dedent("""\
+        XX.
+        OO.
+        ...
+        """))
+    cursor = start_state.create_cursor()
+
+    cursor.push(2)
+    winner = cursor.winner()
+    state = cursor.get_state()
+    cursor.pop()
+
+    assert winner == TicTacToeState.X_PLAYER
+    assert state == start_state.make_move(2)
+    assert cursor.get_state() is start_state.table.get_state(start_state.index)
+    assert cursor.valid_moves() == (2, 5, 6, 7, 8)
+
+
+def test_table_cursor_invalid_move():
+    start_state = TicTacToeTableState().make_move(4)
+    cursor = start_state.create_cursor()
+
+    with pytest.raises(ValueError, match=r'Invalid move: 4\.'):
+        cursor.push(4)
+
+    assert cursor.depth == 0
+    assert cursor.get_state() is start_state
@@ -1,12 +1,87 @@
+import typing
 from copy import copy
+from functools import cache
 
 import numpy as np
 
-from zero_play.game_state import GridGameState
+from zero_play.game_state import (BitboardGameState, BitboardCursor,
+                                  GridGeometry, memoized, ArrayBatch,
+                                  GameState, LineRules, Transition)
 
 
-class Connect4State(GridGameState):
+class Connect4Rules:
+    """ Connect 4 drops and wins for one board size, on column bitboards.
+
+    Each column takes board_height + 1 bits, counting up from the bottom
+    space, so bit number column*(board_height+1) + height is set when a piece
+    sits that many spaces above the bottom of the column. The extra bit at
+    the top of each column is never set, so the line checks in line_rules
+    can shift a whole bitboard by a column or a diagonal step without
+    carrying pieces from one column into the next. The standard 6x7 board
+    takes 49 bits, and any size up to 64 bits fits in a machine word.
+    Use get() to find the single instance for each board size.
+    """
+    def __init__(self, geometry: GridGeometry):
+        self.geometry = geometry
+        board_height = geometry.board_height
+        board_width = geometry.board_width
+        column_size = board_height + 1
+        self.bit_count = column_size * board_width
+        self.bottom_bits = tuple(1 << (j*column_size)
+                                 for j in range(board_width))
+        self.top_bits = tuple(bottom_bit << (board_height - 1)
+                              for bottom_bit in self.bottom_bits)
+        self.top_mask = sum(self.top_bits)
+        self.column_masks = tuple(((1 << board_height) - 1) << (j*column_size)
+                                  for j in range(board_width))
+
+        # One step down a row is one bit lower in the column.
+        self.line_rules = LineRules.get(board_height,
+                                        board_width,
+                                        4,
+                                        row_stride=-1,
+                                        column_stride=column_size)
+
+        # space_bits[space] is the bit number for a space in row-major order,
+        # and bit_spaces[bit_number] is the space, or -1 for a top bit.
+        self.space_bits = self.line_rules.space_bits
+        bit_spaces = [-1] * self.bit_count
+        for space, bit_number in enumerate(self.space_bits.tolist()):
+            bit_spaces[bit_number] = space
+        self.bit_spaces = tuple(bit_spaces)
+
+    @staticmethod
+    @cache
+    def get(geometry: GridGeometry) -> 'Connect4Rules':
+        """ Get the shared instance for a board size. """
+        return Connect4Rules(geometry)
+
+    def find_drop_bit(self, occupied: int, column: int) -> int:
+        """ Find the lowest empty space in a column.
+
+        :param occupied: bit mask of all the spaces with pieces in them
+        :param column: the column to drop a piece into
+        :return: a bit mask with just the space's bit set, or 0 if the column
+            is full.
+        """
+        return (occupied + self.bottom_bits[column]) & self.column_masks[column]
+
+    def find_open_columns(self, occupied: int) -> typing.List[int]:
+        """ List the columns that still have room for a piece. """
+        return [column
+                for column, top_bit in enumerate(self.top_bits)
+                if not occupied & top_bit]
+
+    def has_four(self, bits: int) -> bool:
+        """ Check for four in a row in any direction. """
+        return self.line_rules.has_line(bits)
+
+
+class Connect4State(BitboardGameState):
+    """ Connect 4 state, with bitboards in Connect4Rules' column layout. """
+    __slots__ = ()
     game_name = 'Connect 4'
+    symmetry = 'mirror'
 
     def __init__(self,
                  text: str | None = None,
@@ -22,11 +97,68 @@ class Connect4State(GridGameState):
                 lines = lines[1:]
         super().__init__(board_height, board_width, lines=lines, spaces=spaces)
 
+    @property
+    def rules(self) -> Connect4Rules:
+        return Connect4Rules.get(self.geometry)
+
+    @classmethod
+    def find_move_permutation(cls,
+                              geometry: GridGeometry,
+                              space_permutation: np.ndarray) -> np.ndarray:
+        # Moves are columns, so follow the top row.
+        return space_permutation[:geometry.board_width] % geometry.board_width
+
+    def create_cursor(self) -> 'Connect4Cursor':
+        return Connect4Cursor(self)
+
+    def create_batch(
+            self,
+            states: typing.Sequence[GameState]) -> 'Connect4Batch':
+        return Connect4Batch.from_states(
+            typing.cast(typing.Sequence[Connect4State], states))
+
+    @property
+    def board_byte_count(self) -> int:
+        # Bytes hold the column layout, with the empty top bits.
+        return (self.rules.bit_count + 7) // 8
+
+    def unpack_spaces(self) -> np.ndarray:
+        rules = self.rules
+        byte_count = self.board_byte_count
+        raw = b''.join(bits.to_bytes(byte_count, 'little')
+                       for bits in self.bitboards)
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(2, byte_count)
+        unpacked = np.unpackbits(packed,
+                                 axis=1,
+                                 count=rules.bit_count,
+                                 bitorder='little')
+        return unpacked[:, rules.space_bits].reshape(2,
+                                                     self.board_height,
+                                                     self.board_width)
+
+    def pack_spaces(self, spaces: np.ndarray):
+        rules = self.rules
+        column_spaces = np.zeros((2, rules.bit_count), dtype=bool)
+        column_spaces[:, rules.space_bits] = np.asarray(spaces).reshape(2, -1)
+        packed = np.packbits(column_spaces, axis=1, bitorder='little')
+        self.bitboards = tuple(int.from_bytes(row.tobytes(), 'little')
+                               for row in packed)
+
+    @memoized('_valid_moves')
     def get_valid_moves(self) -> np.ndarray:
         if self.get_winner() != self.NO_PLAYER:
             return np.zeros(self.board_width, dtype=bool)
-        # Any zero value in top row is a valid move
-        return self.spaces[:, 0].sum(axis=0) == 0
+        # Any empty space in top row is a valid move
+        occupied = self.bitboards[0] | self.bitboards[1]
+        return np.array([not occupied & top_bit
+                         for top_bit in self.rules.top_bits])
+
+    @memoized('_valid_move_indices')
+    def get_valid_move_indices(self) -> np.ndarray:
+        if self.get_winner() != self.NO_PLAYER:
+            return np.zeros(0, dtype=int)
+        occupied = self.bitboards[0] | self.bitboards[1]
+        return np.array(self.rules.find_open_columns(occupied), dtype=int)
 
     def display(self, show_coordinates: bool = False) -> str:
         header = '1234567\n' if show_coordinates else ''
@@ -40,48 +172,102 @@ class Connect4State(GridGameState):
 
     def make_move(self, move: int) -> 'Connect4State':
         moving_player = self.get_active_player()
-        new_board = copy(self)
-        spaces = new_board.spaces
-        empty_spaces = spaces.sum(axis=0) == 0
-        available_idx, = np.where(empty_spaces[:, move])
+        rules = self.rules
+        occupied = self.bitboards[0] | self.bitboards[1]
+        move_bit = rules.find_drop_bit(occupied, int(move))
+        if not move_bit:
+            raise ValueError('Column is full.')
+        space = rules.bit_spaces[move_bit.bit_length() - 1]
 
         piece_type = self.piece_types.index(moving_player)
-        spaces[piece_type, available_idx[-1], move] = 1
-        new_board.spaces = spaces
-        return new_board
+        new_board = copy(self)
+        bitboards = list(self.bitboards)
+        bitboards[piece_type] |= move_bit
+        new_board.bitboards = tuple(bitboards)
+        zobrist_table = self.zobrist_table
+        new_board._zobrist_key = (self.zobrist_key ^
+                                  zobrist_table.piece_keys[piece_type][space] ^
+                                  zobrist_table.side_key)
+        new_board.record_move(self, space, moving_player)
+        return new_board.intern()
+
+    def step(self, move: int) -> Transition:
+        new_state = self.make_move(move)
+        winner = new_state.get_winner()
+        if winner != self.NO_PLAYER:
+            move_indices = np.zeros(0, dtype=int)
+        else:
+            # Only the column that was played can fill up.
+            move_indices = self.get_valid_move_indices()
+            occupied = new_state.bitboards[0] | new_state.bitboards[1]
+            if occupied & self.rules.top_bits[move]:
+                move_indices = move_indices[move_indices != move]
+        return new_state.record_status(winner,
+                                       -self.get_active_player(),
+                                       move_indices)
 
     def is_win(self, player: int) -> bool:
         """ Has the given player collected four in a row in any direction? """
-        row_count, column_count = self.board_height, self.board_width
-        win_count = 4
-        spaces = self.spaces
         piece_type = self.piece_types.index(player)
-        player_pieces = spaces[piece_type]
-        if self.is_horizontal_win(player_pieces, win_count):
-            return True
-        if self.is_horizontal_win(player_pieces.transpose(), win_count):
+        return self.rules.has_four(self.bitboards[piece_type])
+
+    def is_win_through(self, player: int, space: int) -> bool:
+        # The shift tests cover the whole board as fast as a single space, so
+        # just skip the other player.
+        return self.is_win(player)
+
+
+class Connect4Cursor(BitboardCursor):
+    def __init__(self, start_state: Connect4State):
+        super().__init__(start_state)
+        self.rules = Connect4Rules.get(self.geometry)
+
+    def find_space(self, move: int) -> int:
+        occupied = self.bitboards[0] | self.bitboards[1]
+        move_bit = self.rules.find_drop_bit(occupied, move)
+        if not move_bit:
+            raise ValueError('Column is full.')
+        return move_bit.bit_length() - 1
+
+    def valid_moves(self) -> typing.Sequence[int]:
+        if self.winner() != Connect4State.NO_PLAYER:
+            return []
+        # Any empty space in top row is a valid move
+        return self.rules.find_open_columns(self.bitboards[0] |
+                                            self.bitboards[1])
+
+    def is_win(self, player: int) -> bool:
+        piece_type = self.piece_types.index(player)
+        return self.rules.has_four(self.bitboards[piece_type])
+
+    def is_ended(self) -> bool:
+        if self.winner() != Connect4State.NO_PLAYER:
             return True
-        # check two diagonal strips
-        for start_row in range(row_count - win_count + 1):
-            for start_column in range(column_count - win_count + 1):
-                count1 = count2 = 0
-                for d in range(win_count):
-                    if player_pieces[start_row + d, start_column + d]:
-                        count1 += 1
-                    if player_pieces[start_row + d,
-                                     start_column + win_count - d - 1]:
-                        count2 += 1
-                if count1 == win_count or count2 == win_count:
-                    return True
-
-        return False
+        occupied = self.bitboards[0] | self.bitboards[1]
+        return occupied & self.rules.top_mask == self.rules.top_mask
 
-    @staticmethod
-    def is_horizontal_win(player_pieces: np.ndarray, win_count):
-        row_count, column_count = player_pieces.shape
-        for i in range(row_count):
-            for j in range(column_count-win_count+1):
-                count = player_pieces[i, j:j+win_count].sum()
-                if count >= win_count:
-                    return True
-        return False
+
+class Connect4Batch(ArrayBatch):
+    template: Connect4State
+
+    def valid_moves(self) -> np.ndarray:
+        # Any empty space in top row is a valid move, unless someone won.
+        top_empty = self.spaces[:, :, 0].sum(axis=1) == 0
+        no_winner = self.winners() == Connect4State.NO_PLAYER
+        return top_empty & no_winner[:, np.newaxis]
+
+    def make_moves(self, moves: typing.Sequence[int]) -> 'Connect4Batch':
+        columns = np.asarray(moves)
+        board_height = self.template.board_height
+        board_width = self.template.board_width
+        column_spaces = self.spaces.sum(axis=1)[self.batch_indexes, :, columns]
+        if column_spaces.all(axis=1).any():
+            raise ValueError('Column is full.')
+        # Drop to the lowest empty row: the first one from the bottom.
+        rows = board_height - 1 - np.argmin(column_spaces[:, ::-1], axis=1)
+        new_spaces = self.place_pieces(rows*board_width + columns)
+        return Connect4Batch(self.template, new_spaces, -self.players)
+
+    def winners(self) -> np.ndarray:
+        line_rules = self.template.rules.line_rules
+        return self.find_line_winners(line_rules.line_spaces)
@@ -1,11 +1,269 @@
-import math
+import pickle
 import typing
+import weakref
+from collections import Counter
+from copy import copy
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import cache, wraps
 
 import numpy as np
 
 
+class ZobristTable:
+    """ Random keys for hashing positions on one size of board.
+
+    Each piece type in each space gets a random 64-bit key, and a position's
+    key is all the keys for its pieces combined with XOR, plus side_key when
+    O_PLAYER is next to move. Keys come from a fixed seed, so all processes
+    agree on them.
+    """
+    def __init__(self, type_count: int, space_count: int):
+        random = np.random.default_rng([type_count, space_count])
+        keys = random.integers(np.iinfo(np.uint64).max,
+                               size=type_count * space_count + 1,
+                               dtype=np.uint64,
+                               endpoint=True)
+        self.side_key = int(keys[-1])
+        self.piece_keys = [
+            [int(key) for key in keys[i*space_count:(i+1)*space_count]]
+            for i in range(type_count)]
+
+
+
+class GridGeometry:
+    """ Details shared by all grid game states with the same board size.
+
+    Use get() to find the single instance for each size.
+    """
+    def __init__(self, board_height: int, board_width: int, type_count: int):
+        self.board_height = board_height
+        self.board_width = board_width
+        self.type_count = type_count
+        self.space_count = board_height * board_width
+        self.full_mask = (1 << self.space_count) - 1
+        self.zobrist_table = ZobristTable(type_count, self.space_count)
+
+    def __repr__(self):
+        return (f'GridGeometry({self.board_height}, {self.board_width}, '
+                f'{self.type_count})')
+
+    def __reduce__(self):
+        # Pickle as a lookup, so unpickled states share the instance.
+        return GridGeometry.get, (self.board_height,
+                                  self.board_width,
+                                  self.type_count)
+
+    @staticmethod
+    @cache
+    def get(board_height: int,
+            board_width: int,
+            type_count: int = 2) -> 'GridGeometry':
+        """ Get the shared instance for a board size. """
+        return GridGeometry(board_height, board_width, type_count)
+
+
+def find_bit_indexes(bits: int) -> typing.List[int]:
+    """ List the positions of all the set bits in a bit mask, lowest first. """
+    indexes = []
+    while bits:
+        low_bit = bits & -bits
+        indexes.append(low_bit.bit_length() - 1)
+        bits ^= low_bit
+    return indexes
+
+
+class LineRules:
+    """ Win checks for games where a player needs a line of pieces in a row.
+
+    Lines run across, down, or along either diagonal of the grid. Each one is
+    stored as an array of row-major space numbers for checking spaces arrays,
+    and as a bit mask for checking bitboards. By default, bit number
+    row*board_width + column is a space, as in BitboardGameState, but any
+    layout where one step across or down always moves by the same number of
+    bits will work, like the columns in Connect 4.
+    Use get() to find the single instance for each size and layout.
+    """
+    def __init__(self,
+                 board_height: int,
+                 board_width: int,
+                 line_length: int,
+                 row_stride: int | None = None,
+                 column_stride: int = 1):
+        """ Initialize an instance.
+
+        :param board_height: number of rows in the grid
+        :param board_width: number of columns in the grid
+        :param line_length: number of pieces in a row that win
+        :param row_stride: bit number change for one step down, or None for
+            board_width
+        :param column_stride: bit number change for one step right
+        """
+        if row_stride is None:
+            row_stride = board_width
+        self.board_height = board_height
+        self.board_width = board_width
+        self.line_length = line_length
+
+        # Shift the layout so the lowest bit number is zero.
+        bit_offset = -(min(0, (board_height-1) * row_stride) +
+                       min(0, (board_width-1) * column_stride))
+        space_bits = np.array([i*row_stride + j*column_stride + bit_offset
+                               for i in range(board_height)
+                               for j in range(board_width)])
+        space_bits.flags.writeable = False
+        self.space_bits = space_bits
+
+        line_spaces = []
+        # [(start_bits, shift_sizes)] for each direction
+        self.directions: typing.List[
+            typing.Tuple[int, typing.Tuple[int, ...]]] = []
+        for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            step = di*row_stride + dj*column_stride
+            if step < 0:
+                # Walk the other way along the line, so shifts are positive.
+                di, dj, step = -di, -dj, -step
+            start_bits = 0
+            for i in range(board_height):
+                for j in range(board_width):
+                    end_i = i + di*(line_length-1)
+                    end_j = j + dj*(line_length-1)
+                    if not (0 <= end_i < board_height and
+                            0 <= end_j < board_width):
+                        continue
+                    line_spaces.append([(i + di*d)*board_width + j + dj*d
+                                        for d in range(line_length)])
+                    start_bits |= 1 << int(space_bits[i*board_width + j])
+            if start_bits:
+                shift_sizes = tuple(step*d for d in range(1, line_length))
+                self.directions.append((start_bits, shift_sizes))
+        line_space_array = np.array(line_spaces,
+                                    dtype=int).reshape(-1, line_length)
+        line_space_array.flags.writeable = False
+        self.line_spaces = line_space_array
+
+        space_bit_list = space_bits.tolist()
+        self.lines = tuple(sum(1 << space_bit_list[space] for space in line)
+                           for line in line_spaces)
+        space_lines: typing.List[typing.List[int]] = [
+            [] for _ in range(board_height * board_width)]
+        for line, spaces in zip(self.lines, line_spaces):
+            for space in spaces:
+                space_lines[space].append(line)
+        self.space_lines = tuple(tuple(lines) for lines in space_lines)
+
+    def __repr__(self):
+        return (f'LineRules({self.board_height}, {self.board_width}, '
+                f'{self.line_length})')
+
+    @staticmethod
+    @cache
+    def get(board_height: int,
+            board_width: int,
+            line_length: int,
+            row_stride: int | None = None,
+            column_stride: int = 1) -> 'LineRules':
+        """ Get the shared instance for a size and layout. """
+        return LineRules(board_height,
+                         board_width,
+                         line_length,
+                         row_stride,
+                         column_stride)
+
+    def has_line(self, bits: int) -> bool:
+        """ Check if a bitboard fills any line.
+
+        Each direction checks all of its lines at once: keep the start bits
+        that have a piece at every step along the line.
+        """
+        for start_bits, shift_sizes in self.directions:
+            runs = bits & start_bits
+            for shift_size in shift_sizes:
+                runs &= bits >> shift_size
+            if runs:
+                return True
+        return False
+
+    def has_line_through(self, bits: int, space: int) -> bool:
+        """ Check if a bitboard fills any line through a space.
+
+        :param bits: the pieces to check
+        :param space: the row-major space number
+        """
+        for line in self.space_lines[space]:
+            if bits & line == line:
+                return True
+        return False
+
+
+def memoized(slot_name: str):
+    """ Decorate a state method to cache its result in a slot.
+
+    The result is only cached when the state's class sets memoize_results
+    to True, and GridGameState.clear_memos() empties all the slots. Cache use
+    is only counted when the class also sets count_memos to True.
+    :param slot_name: the slot that holds the result, or None if it hasn't
+        been calculated yet.
+    """
+    def decorate(method):
+        method_name = method.__name__
+
+        @wraps(method)
+        def wrapper(self):
+            if not self.memoize_results:
+                return method(self)
+            result = getattr(self, slot_name)
+            if result is None:
+                if self.count_memos:
+                    self.memo_misses[method_name] += 1
+                result = method(self)
+                if isinstance(result, np.ndarray):
+                    result.flags.writeable = False
+                setattr(self, slot_name, result)
+            elif self.count_memos:
+                self.memo_hits[method_name] += 1
+            return result
+        return wrapper
+    return decorate
+
+
+@cache
+def find_slot_names(state_class: type) -> typing.Tuple[str, ...]:
+    """ List the instance slots that a class and its base classes declare. """
+    slot_names: typing.List[str] = []
+    for base_class in state_class.__mro__:
+        slots = base_class.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        slot_names.extend(name
+                          for name in slots
+                          if name not in ('__dict__', '__weakref__'))
+    return tuple(slot_names)
+
+
+@dataclass(frozen=True)
+class Transition:
+    """ A state that a move led to, along with its status. """
+    state: 'GameState'
+    is_ended: bool
+    winner: int
+    active_player: int
+    move_indices: np.ndarray  # see GameState.get_valid_move_indices()
+
+    @staticmethod
+    def from_state(state: 'GameState') -> 'Transition':
+        """ Ask a state for its status, one question at a time. """
+        winner = state.get_winner()
+        move_indices = state.get_valid_move_indices()
+        return Transition(state,
+                          state.is_ended(),
+                          winner,
+                          state.get_active_player(),
+                          move_indices)
+
+
 class GameState(ABC):
+    __slots__ = ()
     DISPLAY_CHARS = 'O.X'
     NO_PLAYER = 0
     X_PLAYER = 1
@@ -22,7 +280,11 @@ class GameState(ABC):
 
     @abstractmethod
     def __eq__(self, other) -> bool:
-        """ Compare with another game state. """
+        """ Compare with another game state.
+
+        Defining __eq__ makes a class unhashable, so subclasses that need to
+        be dictionary keys, like GridGameState, also define __hash__.
+        """
 
     @abstractmethod
     def get_valid_moves(self) -> np.ndarray:
@@ -33,6 +295,15 @@ class GameState(ABC):
             the move value to pass to make_move().
         """
 
+    def get_valid_move_indices(self) -> np.ndarray:
+        """ List the valid moves for this board state.
+
+        :return: an array with the index of each True entry in the result of
+            get_valid_moves(), in increasing order. Games can override this
+            to find the moves without building the full array.
+        """
+        return np.flatnonzero(self.get_valid_moves())
+
     def is_ended(self) -> bool:
         """ Has the game ended in the given board? """
         if self.get_winner() != self.NO_PLAYER:
@@ -62,6 +333,24 @@ class GameState(ABC):
     def get_players(self) -> typing.Iterable[int]:
         return self.X_PLAYER, self.O_PLAYER
 
+    def create_cursor(self) -> 'GameCursor':
+        """ Create a cursor that pushes and pops moves, starting here.
+
+        This default wraps make_move(), so it works for any game. Games can
+        override it to return a cursor that changes one position in place.
+        """
+        return StateCursor(self)
+
+    def create_batch(self,
+                     states: typing.Sequence['GameState']) -> 'BatchGameState':
+        """ Collect several states of this game to apply the rules to all at
+        once.
+
+        This default calls each state's methods in turn, so it works for any
+        game. Games can override it to return a batch with vectorized rules.
+        """
+        return StateBatch(states)
+
     @abstractmethod
     def get_move_count(self) -> int:
         """ The number of moves that have already been made in the game. """
@@ -118,6 +407,15 @@ class GameState(ABC):
         :return: an array of piece values, updated by the move.
         """
 
+    def step(self, move: int) -> Transition:
+        """ Make a move, and find the new state's status at the same time.
+
+        This default asks the new state each question separately. Games can
+        override it to share work with this state or between the questions.
+        :param move: the index of a move in the result of get_valid_moves().
+        """
+        return Transition.from_state(self.make_move(move))
+
     def get_winner(self) -> int:
         """ Decide which player has won, if any.
         
@@ -130,6 +428,18 @@ class GameState(ABC):
 
         return self.NO_PLAYER
 
+    @classmethod
+    def can_change_winner(cls, winner: int, player: int) -> bool:
+        """ Check if a new line for a player would change the winner.
+
+        Games like Tic Tac Toe allow moves after a win, so both players can
+        end up with a line. get_winner() checks X_PLAYER first, so a new line
+        for X_PLAYER takes over from O_PLAYER, but not the other way around.
+        :param winner: the winner before the move
+        :param player: the player who moved
+        """
+        return winner != cls.X_PLAYER and winner != player
+
     @abstractmethod
     def is_win(self, player: int) -> bool:
         """ Check if the given player has won on this board state.
@@ -138,10 +448,156 @@ class GameState(ABC):
         :return: True if the player has won.
         """
 
+    def to_bytes(self) -> bytes:
+        """ Serialize this state to send to another process or to store.
+
+        This default pickles the whole state, so it works for any game. Games
+        can override it with a compact format.
+        """
+        return pickle.dumps(self)
+
+    def from_bytes(self, data: bytes) -> 'GameState':
+        """ Rebuild a state from the result of to_bytes().
+
+        Call this on any state of the same game and board size.
+        """
+        return pickle.loads(data)
+
+
+class GridSymmetry:
+    """ A rotation or reflection of a grid board that doesn't change the rules.
+
+    Permutations list, for each space or move in the transformed orientation,
+    the space or move that it came from in the original orientation.
+    """
+    def __init__(self,
+                 name: str,
+                 space_permutation: np.ndarray,
+                 move_permutation: np.ndarray):
+        self.name = name
+        self.space_permutation = space_permutation
+        self.move_permutation = move_permutation
+        self.inverse_move_permutation = np.argsort(move_permutation)
+        for array in (space_permutation,
+                      move_permutation,
+                      self.inverse_move_permutation):
+            array.flags.writeable = False
+
+    def __repr__(self):
+        return f'GridSymmetry({self.name!r})'
+
+    @property
+    def is_identity(self) -> bool:
+        return self.name == 'identity'
+
+    def transform_spaces(self, spaces: np.ndarray) -> np.ndarray:
+        """ Move the pieces in a spaces array to the new orientation. """
+        flat_spaces = spaces.reshape(spaces.shape[:-2] + (-1,))
+        return flat_spaces[..., self.space_permutation].reshape(spaces.shape)
+
+    def transform_move_values(self, values: np.ndarray) -> np.ndarray:
+        """ Rearrange a value for each move, like valid moves or move
+        probabilities, to the new orientation.
+        """
+        return values[..., self.move_permutation]
+
+    def transform_move(self, move: int) -> int:
+        """ Find where a move in the original orientation goes. """
+        return int(self.inverse_move_permutation[move])
+
+    def restore_move(self, move: int) -> int:
+        """ Find where a move in the new orientation came from. """
+        return int(self.move_permutation[move])
+
+    @staticmethod
+    @cache
+    def find_space_permutations(
+            board_height: int,
+            board_width: int,
+            symmetry: str) -> typing.Tuple[typing.Tuple[str, np.ndarray], ...]:
+        """ Find the board transformations for a kind of symmetry.
+
+        :param board_height: number of rows in the grid
+        :param board_width: number of columns in the grid
+        :param symmetry: 'none', 'mirror' for left to right, or 'dihedral'
+            for all the rotations and reflections that keep the board's shape
+        :return: ((name, space_permutation)) starting with the identity
+        """
+        spaces = np.arange(board_height*board_width).reshape(board_height,
+                                                             board_width)
+        transforms: typing.List[typing.Tuple[str, np.ndarray]] = [
+            ('identity', spaces)]
+        if symmetry == 'mirror':
+            transforms.append(('mirror', spaces[:, ::-1]))
+        elif symmetry == 'dihedral':
+            transforms.extend([('rotate90', np.rot90(spaces)),
+                               ('rotate180', np.rot90(spaces, 2)),
+                               ('rotate270', np.rot90(spaces, 3)),
+                               ('mirror', spaces[:, ::-1]),
+                               ('flip', spaces[::-1]),
+                               ('transpose', spaces.T),
+                               ('anti_transpose', np.rot90(spaces, 2).T)])
+        elif symmetry != 'none':
+            raise ValueError(f'Unknown symmetry: {symmetry!r}.')
+        return tuple((name, transformed.ravel())
+                     for name, transformed in transforms
+                     if transformed.shape == spaces.shape)
+
+
+# Lets methods that copy a state return the caller's own state class.
+GridStateType = typing.TypeVar('GridStateType', bound='GridGameState')
+
 
 # noinspection PyAbstractClass
 class GridGameState(GameState):
-    """ Game state for a simple grid with pieces on it. """
+    """ Game state for a simple grid with pieces on it.
+
+    States use __slots__ to keep search trees small, so subclasses that add
+    attributes should declare their own __slots__.
+    """
+    __slots__ = ('geometry',
+                 'packed',
+                 '_cached_spaces',
+                 '_zobrist_key',
+                 '_move_count',
+                 '_valid_moves',
+                 '_valid_move_indices',
+                 '_active_player',
+                 '_winner',
+                 '_is_ended',
+                 'last_space',
+                 '__weakref__')
+
+    # Keep a read-only copy of the unpacked spaces on each state after the
+    # first read. Set to False to save memory in large search trees.
+    cache_spaces = True
+
+    # Share one state object between identical positions that make_move()
+    # reaches through different move orders. States must not be changed
+    # after make_move() returns them.
+    intern_states = False
+    interned_states: typing.MutableMapping[
+        typing.Tuple[type, int],
+        'GridGameState'] = weakref.WeakValueDictionary()
+
+    # Cache the results of get_move_count(), get_valid_moves(),
+    # get_valid_move_indices(), get_active_player(), get_winner(), and
+    # is_ended() on each state. Only
+    # turn this on if states don't change after they're created, or if they
+    # call clear_memos() when they do. If count_memos is on, memo_hits and
+    # memo_misses count cache use for each method, and each subclass gets its
+    # own counters in __init_subclass__(). Counting is off by default,
+    # because searches call these methods on every iteration.
+    memoize_results = False
+    count_memos = False
+    memo_hits: typing.Counter[str] = Counter()
+    memo_misses: typing.Counter[str] = Counter()
+
+    # Board transformations that don't change the rules: 'none', 'mirror'
+    # for left to right, or 'dihedral' for all the rotations and reflections
+    # that keep the board's shape. See GridSymmetry.
+    symmetry = 'none'
+
     def __init__(self,
                  board_height: int,
                  board_width: int,
@@ -159,17 +615,20 @@ class GridGameState(GameState):
             in a grid space, 0 when it isn't, with shape
             (piece_type_count, board_height, board_width)
         """
-        self.board_height = board_height
-        self.board_width = board_width
+        self.geometry = GridGeometry.get(board_height,
+                                         board_width,
+                                         len(self.piece_types))
+        self._cached_spaces: np.ndarray | None = None
+        self._zobrist_key: int | None = None
+        self.clear_memos()
         if spaces is not None:
             assert text is None
             assert lines is None
             self.spaces = spaces
             return
         type_count = len(self.piece_types)
-        packed = np.zeros(math.ceil(board_height*board_width*type_count/8),
+        spaces = np.zeros((type_count, board_height, board_width),
                           dtype=np.uint8)
-        self.packed = packed
         if text:
             lines = text.splitlines()
         if lines:
@@ -180,21 +639,186 @@ class GridGameState(GameState):
             line_array = np.array(lines, dtype=str)
             chars = line_array.view('U1').reshape(self.board_height,
                                                   self.board_width)
-            spaces = self.get_spaces()
             for layer, display_char in enumerate(self.piece_displays):
                 spaces[layer] = chars == display_char
-        if spaces is not None:
-            self.spaces = spaces
+        self.spaces = spaces
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Otherwise, all the games would count in the same Counter objects.
+        cls.memo_hits = Counter()
+        cls.memo_misses = Counter()
 
     def __repr__(self):
         board_text = self.display()
         return f'{self.__class__.__name__}({board_text!r})'
 
+    def __copy__(self: GridStateType) -> GridStateType:
+        state_class = self.__class__
+        new_state = state_class.__new__(state_class)
+        for name in find_slot_names(state_class):
+            try:
+                setattr(new_state, name, getattr(self, name))
+            except AttributeError:
+                pass  # Slot was never set.
+        if hasattr(self, '__dict__'):
+            new_state.__dict__.update(self.__dict__)
+        # Copies are made to be changed.
+        new_state._cached_spaces = None
+        new_state.clear_memos()
+        return new_state
+
+    @property
+    def board_height(self) -> int:
+        return self.geometry.board_height
+
+    @property
+    def board_width(self) -> int:
+        return self.geometry.board_width
+
+    def clear_memos(self):
+        """ Forget the cached results of methods decorated with memoized().
+
+        Call this after changing a state's pieces or active player.
+        """
+        self._move_count = self._valid_moves = self._active_player = None
+        self._valid_move_indices = self._winner = self._is_ended = None
+
+    @classmethod
+    def clear_memo_counts(cls):
+        """ Reset memo_hits and memo_misses for this class only.
+
+        This doesn't happen in clear_memos(), because every new state calls
+        that.
+        """
+        cls.memo_hits.clear()
+        cls.memo_misses.clear()
+
+    @classmethod
+    def get_memo_hit_rates(cls) -> typing.Dict[str, float]:
+        """ Report the fraction of calls to each memoized method that were
+        answered from the cache.
+        """
+        method_names = sorted(cls.memo_hits.keys() | cls.memo_misses.keys())
+        return {method_name: (cls.memo_hits[method_name] /
+                              (cls.memo_hits[method_name] +
+                               cls.memo_misses[method_name]))
+                for method_name in method_names}
+
+    def get_symmetries(self) -> typing.Tuple[GridSymmetry, ...]:
+        """ List the symmetries of this game's board, starting with the
+        identity.
+        """
+        return self.find_symmetries(self.__class__, self.geometry)
+
+    @staticmethod
+    @cache
+    def find_symmetries(
+            state_class: typing.Type['GridGameState'],
+            geometry: GridGeometry) -> typing.Tuple[GridSymmetry, ...]:
+        permutations = GridSymmetry.find_space_permutations(
+            geometry.board_height,
+            geometry.board_width,
+            state_class.symmetry)
+        return tuple(GridSymmetry(
+            name,
+            space_permutation,
+            state_class.find_move_permutation(geometry, space_permutation))
+                     for name, space_permutation in permutations)
+
+    @classmethod
+    def find_move_permutation(cls,
+                              geometry: GridGeometry,
+                              space_permutation: np.ndarray) -> np.ndarray:
+        """ Convert a permutation of spaces to a permutation of moves.
+
+        By default, each move is a space number.
+        """
+        return space_permutation
+
+    def transform(self, symmetry: GridSymmetry) -> 'GridGameState':
+        """ Copy this state with the board rotated or reflected. """
+        if symmetry.is_identity:
+            return self
+        new_state = copy(self)
+        new_state.spaces = symmetry.transform_spaces(self.spaces)
+        return new_state
+
+    def find_canonical(self) -> typing.Tuple['GridGameState', GridSymmetry]:
+        """ Find the orientation of this position that all its symmetric
+        positions share.
+
+        :return: (canonical_state, symmetry) where the canonical state is
+            this state transformed by symmetry. Use the symmetry to convert
+            moves between the two orientations.
+        """
+        spaces = self.spaces
+        best_symmetry = best_key = None
+        for symmetry in self.get_symmetries():
+            key = symmetry.transform_spaces(spaces).tobytes()
+            if best_key is None or key < best_key:
+                best_key = key
+                best_symmetry = symmetry
+        assert best_symmetry is not None
+        return self.transform(best_symmetry), best_symmetry
+
+    def intern(self: GridStateType) -> GridStateType:
+        """ Find the shared state object that equals this one.
+
+        :return: this state if intern_states is False or this position
+            hasn't been seen, otherwise the equal state that was interned
+            first.
+        """
+        if not self.intern_states:
+            return self
+        key = (self.__class__, self.zobrist_key)
+        interned_state = self.interned_states.get(key)
+        if interned_state is None:
+            self.interned_states[key] = self
+            return self
+        if interned_state == self:
+            # The key includes the class, so it matches self's class.
+            return typing.cast(GridStateType, interned_state)
+        return self  # Key collision, so don't intern.
+
     def __eq__(self, other):
         if not isinstance(other, GridGameState):
             return False
+        if self.zobrist_key != other.zobrist_key:
+            return False
         return np.array_equal(self.spaces, other.spaces)
 
+    def __hash__(self):
+        return self.zobrist_key
+
+    @property
+    def zobrist_key(self) -> int:
+        """ A 64-bit key for this position, see ZobristTable.
+
+        make_move() updates the key from the parent state's key, so it's
+        only calculated from scratch for states built from text or arrays.
+        """
+        key = self._zobrist_key
+        if key is None:
+            key = self._zobrist_key = self.calculate_zobrist_key()
+        return key
+
+    @property
+    def zobrist_table(self) -> ZobristTable:
+        return self.geometry.zobrist_table
+
+    def calculate_zobrist_key(self) -> int:
+        """ Calculate this position's key from all the pieces on the board. """
+        piece_keys = self.zobrist_table.piece_keys
+        type_count = len(self.piece_types)
+        flat_spaces = self.spaces.reshape(type_count, -1)
+        key = 0
+        for piece_type, space in zip(*np.nonzero(flat_spaces)):
+            key ^= piece_keys[piece_type][space]
+        if self.get_active_player() == self.O_PLAYER:
+            key ^= self.zobrist_table.side_key
+        return key
+
     @property
     def piece_types(self):
         return self.X_PLAYER, self.O_PLAYER
@@ -203,11 +827,61 @@ class GridGameState(GameState):
     def piece_displays(self):
         return 'XO'
 
+    @memoized('_move_count')
     def get_move_count(self) -> int:
         return self.spaces.sum()
 
+    @memoized('_active_player')
+    def get_active_player(self) -> int:
+        return super().get_active_player()
+
+    @memoized('_winner')
+    def get_winner(self) -> int:
+        return super().get_winner()
+
+    @memoized('_valid_move_indices')
+    def get_valid_move_indices(self) -> np.ndarray:
+        return super().get_valid_move_indices()
+
+    @memoized('_is_ended')
+    def is_ended(self) -> bool:
+        return super().is_ended()
+
     @property
     def spaces(self) -> np.ndarray:
+        """ Read-only view of the board spaces, shared by all readers.
+
+        Call mutable_spaces() to get a copy that can be changed.
+        """
+        spaces = self._cached_spaces
+        if spaces is None:
+            spaces = self.unpack_spaces()
+            spaces.flags.writeable = False
+            if self.cache_spaces:
+                self._cached_spaces = spaces
+        return spaces
+
+    @spaces.setter
+    def spaces(self, spaces):
+        self.pack_spaces(spaces)
+        self._cached_spaces = None
+        self._zobrist_key = None
+        self.last_space = None
+        self.clear_memos()
+
+    def mutable_spaces(self) -> np.ndarray:
+        """ Get a private copy of the board spaces that the caller can change.
+        """
+        if self._cached_spaces is None:
+            return self.unpack_spaces()
+        return self._cached_spaces.copy()
+
+    def drop_cached_spaces(self):
+        """ Release the cached spaces, they get rebuilt on the next read. """
+        self._cached_spaces = None
+
+    def unpack_spaces(self) -> np.ndarray:
+        """ Build a new spaces array from the stored board. """
         type_count = len(self.piece_types)
         trimmed_size = self.board_height * self.board_width * type_count
         trimmed = np.unpackbits(self.packed)[:trimmed_size]
@@ -215,10 +889,11 @@ class GridGameState(GameState):
                                self.board_height,
                                self.board_width)
 
-    @spaces.setter
-    def spaces(self, spaces):
+    def pack_spaces(self, spaces: np.ndarray):
+        """ Store the board from a spaces array. """
         self.packed = np.packbits(spaces)
 
+    @memoized('_valid_moves')
     def get_valid_moves(self) -> np.ndarray:
         spaces = self.get_spaces()
         full_spaces = np.logical_or.accumulate(spaces)[-1]
@@ -268,10 +943,636 @@ class GridGameState(GameState):
     def make_move(self, move: int) -> 'GridGameState':
         moving_player = self.get_active_player()
         piece_type = self.piece_types.index(moving_player)
-        new_spaces = self.get_spaces()  # always an unpacked copy
+        new_spaces = self.mutable_spaces()
         i, j = move // self.board_width, move % self.board_width
         new_spaces[piece_type, i, j] = 1
 
-        return self.__class__(board_height=self.board_height,
-                              board_width=self.board_width,
-                              spaces=new_spaces)
+        new_state = self.__class__(board_height=self.board_height,
+                                   board_width=self.board_width,
+                                   spaces=new_spaces)
+        zobrist_table = self.zobrist_table
+        new_state._zobrist_key = (self.zobrist_key ^
+                                  zobrist_table.piece_keys[piece_type][move] ^
+                                  zobrist_table.side_key)
+        new_state.record_move(self, move, moving_player)
+        return new_state.intern()
+
+    def record_move(self,
+                    previous_state: 'GridGameState',
+                    space: int,
+                    player: int):
+        """ Remember the space that the last move filled, and the winner.
+
+        Only the lines through the new piece can change the winner, so this
+        checks them with is_win_through() instead of scanning the whole
+        board. States built from text or arrays don't know their last move,
+        so get_winner() scans them.
+        :param previous_state: the state before the move
+        :param space: the space where the move put a piece
+        :param player: the player who moved
+        """
+        self.last_space = space
+        if not self.memoize_results:
+            return
+        winner = previous_state.get_winner()
+        if (self.can_change_winner(winner, player) and
+                self.is_win_through(player, space)):
+            winner = player
+        self._winner = winner
+
+    def is_win_through(self, player: int, space: int) -> bool:
+        """ Check if the given player has won with a line through a space.
+
+        The default checks the whole board, so subclasses should override it
+        to only check the lines through the space.
+        """
+        return self.is_win(player)
+
+    def record_status(self,
+                      winner: int,
+                      active_player: int,
+                      move_indices: np.ndarray,
+                      is_ended: bool | None = None) -> Transition:
+        """ Build the transition for a step() to this state.
+
+        If memoize_results is on, this also caches the status, so later calls
+        don't have to work it out again.
+        :param winner: the winner in this state
+        :param active_player: the player to move next
+        :param move_indices: the valid moves, as in get_valid_move_indices()
+        :param is_ended: True if the game is over, or None when it's over if
+            someone won or there are no valid moves
+        """
+        if is_ended is None:
+            is_ended = winner != self.NO_PLAYER or len(move_indices) == 0
+        if self.memoize_results:
+            move_indices.flags.writeable = False
+            self._winner = winner
+            self._active_player = active_player
+            self._valid_move_indices = move_indices
+            self._is_ended = is_ended
+        return Transition(self, is_ended, winner, active_player, move_indices)
+
+    @property
+    def board_byte_count(self) -> int:
+        """ Number of bytes that to_bytes() uses for each piece type. """
+        return (self.geometry.space_count + 7) // 8
+
+    @property
+    def byte_count(self) -> int:
+        """ Number of bytes that to_bytes() returns. """
+        return self.geometry.type_count * self.board_byte_count + 1
+
+    def to_bytes(self) -> bytes:
+        """ Pack the board and the active player into byte_count bytes.
+
+        Each piece type takes board_byte_count bytes, with one bit per space
+        in little-endian bit order, then one signed byte holds the active
+        player. Unlike a pickle, this leaves out the class and the board
+        size, so from_bytes() needs a state of the same game and size.
+        """
+        return self.pack_board() + self.get_active_player().to_bytes(
+            1, 'little', signed=True)
+
+    def from_bytes(self, data: bytes) -> 'GridGameState':
+        if len(data) != self.byte_count:
+            raise ValueError(
+                f'Expected {self.byte_count} bytes, but found {len(data)}.')
+        new_state = self.unpack_board(data[:-1])
+        new_state.restore_active_player(
+            int.from_bytes(data[-1:], 'little', signed=True))
+        return new_state
+
+    def pack_board(self) -> bytes:
+        """ Pack the pieces on the board for to_bytes(). """
+        flat_spaces = self.spaces.reshape(self.geometry.type_count, -1) != 0
+        return np.packbits(flat_spaces, axis=1, bitorder='little').tobytes()
+
+    def unpack_board(self, data: bytes) -> 'GridGameState':
+        """ Copy this state, but with the pieces from pack_board(). """
+        type_count = self.geometry.type_count
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(type_count, -1)
+        spaces = np.unpackbits(packed,
+                               axis=1,
+                               count=self.geometry.space_count,
+                               bitorder='little')
+        new_state = copy(self)
+        new_state.spaces = spaces.reshape(type_count,
+                                          self.board_height,
+                                          self.board_width)
+        return new_state
+
+    def restore_active_player(self, player: int):
+        """ Set the active player that from_bytes() found.
+
+        By default, the active player comes from counting pieces, so this
+        ignores it. Games that store the active player should override it.
+        """
+
+    def pack_many(self, states: typing.Sequence['GridGameState']) -> np.ndarray:
+        """ Pack several states of this game into one array.
+
+        :param states: states with the same board size as this one
+        :return: an array of bytes with shape (len(states), byte_count), where
+            each row matches to_bytes() for one state
+        """
+        type_count = self.geometry.type_count
+        spaces = np.array([state.spaces for state in states], dtype=bool)
+        packed = np.packbits(spaces.reshape(len(states), type_count, -1),
+                             axis=2,
+                             bitorder='little')
+        players = np.fromiter((state.get_active_player() for state in states),
+                              dtype=np.int8,
+                              count=len(states))
+        return np.concatenate([packed.reshape(len(states), -1),
+                               players.view(np.uint8)[:, np.newaxis]],
+                              axis=1)
+
+    def unpack_many(self,
+                    packed: np.ndarray) -> typing.List['GridGameState']:
+        """ Rebuild a list of states from the result of pack_many(). """
+        if packed.ndim != 2 or packed.shape[1] != self.byte_count:
+            raise ValueError(f'Expected rows of {self.byte_count} bytes, '
+                             f'but found shape {packed.shape}.')
+        type_count = self.geometry.type_count
+        state_count = len(packed)
+        boards = np.ascontiguousarray(packed[:, :-1], dtype=np.uint8)
+        spaces = np.unpackbits(boards.reshape(state_count, type_count, -1),
+                               axis=2,
+                               count=self.geometry.space_count,
+                               bitorder='little')
+        spaces = spaces.reshape(state_count,
+                                type_count,
+                                self.board_height,
+                                self.board_width)
+        players = packed[:, -1].astype(np.uint8).view(np.int8).tolist()
+        states = []
+        for state_spaces, player in zip(spaces, players):
+            new_state = copy(self)
+            new_state.spaces = state_spaces
+            new_state.restore_active_player(player)
+            states.append(new_state)
+        return states
+
+
+# noinspection PyAbstractClass
+class BitboardGameState(GridGameState):
+    """ Grid game state that stores each piece type as a bit mask.
+
+    Bit number row*board_width + column of bitboards[piece_type] is set when a
+    piece of that type is in that space. Subclasses opt in to this
+    representation instead of the packed array in GridGameState, and the
+    spaces array is only built when a caller asks for it.
+    """
+    __slots__ = ('bitboards',)
+    bitboards: typing.Tuple[int, ...]
+    memoize_results = True
+    # Rebuilding spaces from the bitboards is cheap, so don't keep an array on
+    # every state in a search tree.
+    cache_spaces = False
+
+    def __eq__(self, other):
+        if not isinstance(other, BitboardGameState):
+            return super().__eq__(other)
+        return (self.zobrist_key == other.zobrist_key and
+                self.bitboards == other.bitboards and
+                self.geometry is other.geometry)
+
+    def __hash__(self):
+        return self.zobrist_key
+
+    def unpack_spaces(self) -> np.ndarray:
+        type_count = len(self.bitboards)
+        size = self.board_height * self.board_width
+        byte_count = (size + 7) // 8
+        raw = b''.join(bits.to_bytes(byte_count, 'little')
+                       for bits in self.bitboards)
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(type_count,
+                                                            byte_count)
+        unpacked = np.unpackbits(packed, axis=1, count=size, bitorder='little')
+        return unpacked.reshape(type_count,
+                                self.board_height,
+                                self.board_width)
+
+    def pack_spaces(self, spaces: np.ndarray):
+        type_count = len(self.piece_types)
+        flat_spaces = np.asarray(spaces).reshape(type_count, -1) != 0
+        packed = np.packbits(flat_spaces, axis=1, bitorder='little')
+        self.bitboards = tuple(int.from_bytes(row.tobytes(), 'little')
+                               for row in packed)
+
+    def bits_to_array(self, bits: int) -> np.ndarray:
+        """ Convert a bit mask into a boolean array with one entry per space.
+        """
+        size = self.board_height * self.board_width
+        raw = np.frombuffer(bits.to_bytes((size + 7) // 8, 'little'),
+                            dtype=np.uint8)
+        return np.unpackbits(raw, count=size, bitorder='little').view(bool)
+
+    def with_bitboards(
+            self,
+            bitboards: typing.Iterable[int]) -> 'BitboardGameState':
+        """ Copy this state, but with different pieces on the board. """
+        new_state = copy(self)
+        new_state.bitboards = tuple(bitboards)
+        new_state._zobrist_key = None
+        new_state.last_space = None
+        return new_state
+
+    def pack_board(self) -> bytes:
+        byte_count = self.board_byte_count
+        return b''.join(bits.to_bytes(byte_count, 'little')
+                        for bits in self.bitboards)
+
+    def unpack_board(self, data: bytes) -> 'BitboardGameState':
+        byte_count = self.board_byte_count
+        return self.with_bitboards(
+            int.from_bytes(data[start:start+byte_count], 'little')
+            for start in range(0, len(data), byte_count))
+
+    def pack_many(self,
+                  states: typing.Sequence['GridGameState']) -> np.ndarray:
+        # The bitboards are already packed, so just join them.
+        data = b''.join(state.to_bytes() for state in states)
+        return np.frombuffer(data, dtype=np.uint8).reshape(len(states),
+                                                           self.byte_count)
+
+    def unpack_many(self,
+                    packed: np.ndarray) -> typing.List['GridGameState']:
+        byte_count = self.byte_count
+        if packed.ndim != 2 or packed.shape[1] != byte_count:
+            raise ValueError(f'Expected rows of {byte_count} bytes, '
+                             f'but found shape {packed.shape}.')
+        data = np.ascontiguousarray(packed, dtype=np.uint8).tobytes()
+        return [self.from_bytes(data[start:start+byte_count])
+                for start in range(0, len(data), byte_count)]
+
+    @memoized('_move_count')
+    def get_move_count(self) -> int:
+        return sum(bits.bit_count() for bits in self.bitboards)
+
+    @memoized('_active_player')
+    def get_active_player(self) -> int:
+        x_count = self.bitboards[0].bit_count()
+        o_count = self.bitboards[1].bit_count()
+        return self.X_PLAYER if x_count == o_count else self.O_PLAYER
+
+    @memoized('_valid_moves')
+    def get_valid_moves(self) -> np.ndarray:
+        occupied = 0
+        for bits in self.bitboards:
+            occupied |= bits
+        return self.bits_to_array(self.geometry.full_mask & ~occupied)
+
+    @memoized('_valid_move_indices')
+    def get_valid_move_indices(self) -> np.ndarray:
+        occupied = 0
+        for bits in self.bitboards:
+            occupied |= bits
+        return np.array(find_bit_indexes(self.geometry.full_mask & ~occupied),
+                        dtype=int)
+
+    def make_move(self, move: int) -> 'BitboardGameState':
+        moving_player = self.get_active_player()
+        piece_type = self.piece_types.index(moving_player)
+        move = int(move)
+        new_state = copy(self)
+        bitboards = list(self.bitboards)
+        bitboards[piece_type] |= 1 << move
+        new_state.bitboards = tuple(bitboards)
+        zobrist_table = self.zobrist_table
+        new_state._zobrist_key = (self.zobrist_key ^
+                                  zobrist_table.piece_keys[piece_type][move] ^
+                                  zobrist_table.side_key)
+        new_state.record_move(self, move, moving_player)
+        return new_state.intern()
+
+
+class GameCursor(ABC):
+    """ Walk through a game by pushing and popping moves on one position.
+
+    Playouts and searches can use a cursor to try out moves without creating
+    a new game state for every move. Create one with
+    GameState.create_cursor().
+    """
+    @property
+    @abstractmethod
+    def depth(self) -> int:
+        """ The number of moves that have been pushed and not popped. """
+
+    @abstractmethod
+    def push(self, move: int):
+        """ Make a move on the current position.
+
+        :param move: the index of a move in the result of valid_moves().
+        """
+
+    @abstractmethod
+    def pop(self):
+        """ Undo the last move that was pushed. """
+
+    @abstractmethod
+    def valid_moves(self) -> typing.Sequence[int]:
+        """ List the moves that are valid in the current position.
+
+        :return: the index of each True entry in the result of
+            GameState.get_valid_moves(), in increasing order.
+        """
+
+    @abstractmethod
+    def winner(self) -> int:
+        """ Decide which player has won the current position, if any. """
+
+    @abstractmethod
+    def active_player(self) -> int:
+        """ Decide which player will play next in the current position. """
+
+    def is_ended(self) -> bool:
+        """ Has the game ended in the current position? """
+        if self.winner() != GameState.NO_PLAYER:
+            return True
+        return len(self.valid_moves()) == 0
+
+    @abstractmethod
+    def get_state(self) -> GameState:
+        """ Get a game state for the current position. """
+
+
+class StateCursor(GameCursor):
+    """ Generic cursor that keeps a stack of transitions made by step(). """
+    def __init__(self, start_state: GameState):
+        self.transitions = [Transition.from_state(start_state)]
+
+    @property
+    def depth(self) -> int:
+        return len(self.transitions) - 1
+
+    def push(self, move: int):
+        self.transitions.append(self.transitions[-1].state.step(move))
+
+    def pop(self):
+        if len(self.transitions) == 1:
+            raise IndexError('No moves to pop.')
+        self.transitions.pop()
+
+    def valid_moves(self) -> typing.Sequence[int]:
+        return self.transitions[-1].move_indices.tolist()
+
+    def winner(self) -> int:
+        return self.transitions[-1].winner
+
+    def active_player(self) -> int:
+        return self.transitions[-1].active_player
+
+    def is_ended(self) -> bool:
+        return self.transitions[-1].is_ended
+
+    def get_state(self) -> GameState:
+        return self.transitions[-1].state
+
+
+class BitboardCursor(GameCursor):
+    """ Cursor that changes a list of bitboards in place.
+
+    By default, each move adds a piece for the active player in the space
+    with the same number as the move. Subclasses must decide who has won, and
+    can make that faster by only checking the lines through the new piece.
+    """
+    def __init__(self, start_state: BitboardGameState):
+        self.start_state = start_state
+        self.geometry = start_state.geometry
+        self.piece_types = start_state.piece_types
+        self.bitboards = list(start_state.bitboards)
+        self.player = start_state.get_active_player()
+        self.spaces_played: typing.List[int] = []
+        # The winner after each move, starting with the start state.
+        self.winners = [start_state.get_winner()]
+
+    @property
+    def depth(self) -> int:
+        return len(self.spaces_played)
+
+    def find_space(self, move: int) -> int:
+        """ Find the space where a move will add a piece. """
+        return move
+
+    def push(self, move: int):
+        space = self.find_space(int(move))
+        piece_type = self.piece_types.index(self.player)
+        self.bitboards[piece_type] |= 1 << space
+        self.spaces_played.append(space)
+        winner = self.winners[-1]
+        if (GameState.can_change_winner(winner, self.player) and
+                self.is_win_through(self.player, space)):
+            winner = self.player
+        self.winners.append(winner)
+        self.player = -self.player
+
+    def pop(self):
+        space = self.spaces_played.pop()
+        self.winners.pop()
+        self.player = -self.player
+        piece_type = self.piece_types.index(self.player)
+        self.bitboards[piece_type] &= ~(1 << space)
+
+    def find_empty_spaces(self) -> int:
+        """ Bit mask of all the spaces without a piece. """
+        occupied = 0
+        for bits in self.bitboards:
+            occupied |= bits
+        return self.geometry.full_mask & ~occupied
+
+    def valid_moves(self) -> typing.Sequence[int]:
+        return find_bit_indexes(self.find_empty_spaces())
+
+    @abstractmethod
+    def is_win(self, player: int) -> bool:
+        """ Check if the given player has won in the current position. """
+
+    def is_win_through(self, player: int, space: int) -> bool:
+        """ Check if the given player has won with a line through a space.
+
+        The default checks the whole board.
+        """
+        return self.is_win(player)
+
+    def winner(self) -> int:
+        return self.winners[-1]
+
+    def is_ended(self) -> bool:
+        if self.winner() != GameState.NO_PLAYER:
+            return True
+        return not self.find_empty_spaces()
+
+    def active_player(self) -> int:
+        return self.player
+
+    def get_state(self) -> BitboardGameState:
+        return self.start_state.with_bitboards(self.bitboards)
+
+
+class BatchGameState(ABC):
+    """ Several positions in the same game, with rules applied to all at once.
+
+    Create one with GameState.create_batch(). Each method returns an array
+    with one entry for each position in the batch.
+    """
+    @abstractmethod
+    def __len__(self) -> int:
+        """ The number of positions in the batch. """
+
+    @property
+    @abstractmethod
+    def spaces(self) -> np.ndarray:
+        """ The board spaces of all the positions.
+
+        :return: an array with shape (batch_size, piece_type_count,
+            board_height, board_width)
+        """
+
+    @abstractmethod
+    def valid_moves(self) -> np.ndarray:
+        """ Decide which moves are valid in each position.
+
+        :return: a boolean array with shape (batch_size, move_count), where
+            each row matches GameState.get_valid_moves().
+        """
+
+    @abstractmethod
+    def make_moves(self, moves: typing.Sequence[int]) -> 'BatchGameState':
+        """ Make one move in each position.
+
+        :param moves: a move for each position in the batch
+        :return: a new batch with the positions after the moves
+        """
+
+    @abstractmethod
+    def winners(self) -> np.ndarray:
+        """ Decide which player has won each position, if any. """
+
+    @abstractmethod
+    def active_players(self) -> np.ndarray:
+        """ Decide which player will play next in each position. """
+
+    def is_ended(self) -> np.ndarray:
+        """ Decide which positions are at the end of the game. """
+        return ((self.winners() != GameState.NO_PLAYER) |
+                ~self.valid_moves().any(axis=1))
+
+    @abstractmethod
+    def get_state(self, index: int) -> GameState:
+        """ Get a game state for one of the positions. """
+
+
+class StateBatch(BatchGameState):
+    """ Generic batch that calls each state's methods in turn. """
+    def __init__(self, states: typing.Sequence[GameState]):
+        self.states = list(states)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    @property
+    def spaces(self) -> np.ndarray:
+        return np.stack([state.spaces for state in self.states])
+
+    def valid_moves(self) -> np.ndarray:
+        return np.stack([state.get_valid_moves() for state in self.states])
+
+    def make_moves(self, moves: typing.Sequence[int]) -> 'StateBatch':
+        return StateBatch([state.make_move(move)
+                           for state, move in zip(self.states, moves)])
+
+    def winners(self) -> np.ndarray:
+        return np.array([state.get_winner() for state in self.states])
+
+    def active_players(self) -> np.ndarray:
+        return np.array([state.get_active_player() for state in self.states])
+
+    def is_ended(self) -> np.ndarray:
+        return np.array([state.is_ended() for state in self.states])
+
+    def get_state(self, index: int) -> GameState:
+        return self.states[index]
+
+
+class ArrayBatch(BatchGameState):
+    """ Batch of grid positions stored in one array, for vectorized rules.
+
+    Subclasses apply a game's rules to the whole array with numpy.
+    """
+    def __init__(self,
+                 template: GridGameState,
+                 spaces: np.ndarray,
+                 players: np.ndarray):
+        """ Initialize an instance.
+
+        :param template: a state of the same game and board size, used to
+            build states for get_state()
+        :param spaces: board spaces, with shape (batch_size,
+            piece_type_count, board_height, board_width)
+        :param players: the active player in each position
+        """
+        self.template = template
+        self._spaces = spaces
+        self.players = players
+
+    @classmethod
+    def from_states(cls, states: typing.Sequence[GridGameState]):
+        return cls(states[0],
+                   np.stack([state.spaces for state in states]),
+                   np.array([state.get_active_player() for state in states],
+                            dtype=np.int8))
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    @property
+    def spaces(self) -> np.ndarray:
+        return self._spaces
+
+    @property
+    def batch_indexes(self) -> np.ndarray:
+        return np.arange(len(self))
+
+    def find_piece_types(self, players: np.ndarray) -> np.ndarray:
+        """ Find the piece type for each player in an array of players. """
+        return np.where(players == self.template.piece_types[0], 0, 1)
+
+    def place_pieces(self, moves: np.ndarray) -> np.ndarray:
+        """ Copy the spaces, and add a piece for the active player at each
+        move.
+
+        :param moves: the space number of each move
+        """
+        new_spaces = self._spaces.copy()
+        rows, columns = np.divmod(moves, self.template.board_width)
+        new_spaces[self.batch_indexes,
+                   self.find_piece_types(self.players),
+                   rows,
+                   columns] = 1
+        return new_spaces
+
+    def find_line_winners(self, lines: np.ndarray) -> np.ndarray:
+        """ Find winners by checking which players fill a line of spaces.
+
+        :param lines: an array of space numbers with one row for each line,
+            like LineRules.line_spaces
+        :return: an array with the winning player for each position, or
+            NO_PLAYER. X_PLAYER wins if both players have a line.
+        """
+        flat_spaces = self._spaces.reshape(len(self), 2, -1).astype(bool)
+        has_line = np.asarray(
+            flat_spaces[:, :, lines].all(axis=-1).any(axis=-1))
+        x_player, o_player = self.template.piece_types
+        return np.where(has_line[:, 0],
+                        x_player,
+                        np.where(has_line[:, 1], o_player, GameState.NO_PLAYER))
+
+    def active_players(self) -> np.ndarray:
+        return self.players
+
+    def get_state(self, index: int) -> GridGameState:
+        state = copy(self.template)
+        state.spaces = self._spaces[index]
+        return state
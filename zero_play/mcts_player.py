@@ -16,11 +16,103 @@ from zero_play.player import Player
 
 logger = logging.getLogger(__name__)
 
+# Each worker process keeps its own heuristic and a template state, so search
+# tasks only send a position's bytes, instead of pickling the state and the
+# heuristic every time.
+worker_heuristic: Heuristic | None = None
+worker_template: GameState | None = None
+
+
+def start_worker(heuristic: Heuristic, template: GameState):
+    """ Set up a worker process for analyse_bytes(). """
+    global worker_heuristic, worker_template
+    worker_heuristic = heuristic
+    worker_template = template
+
+
+def analyse_bytes(data: bytes) -> typing.Tuple[float, np.ndarray]:
+    """ Analyse a position in a worker process.
+
+    :param data: the position, from GameState.to_bytes()
+    :return: the value and policy from Heuristic.analyse()
+    """
+    assert worker_heuristic is not None
+    assert worker_template is not None
+    return worker_heuristic.analyse(worker_template.from_bytes(data))
+
+
+# The (node, child_index) steps that select_leaf() took, for record_value().
+SearchPath = typing.List[typing.Tuple['SearchNode', int]]
+
+
+class MctsNode(typing.Protocol):
+    """ The node interface that SearchManager searches with.
+
+    SearchNode implements it with objects, and ArraySearchNode implements it
+    with an entry in a SearchTree. The attributes are read-only here, so
+    either plain attributes or properties can provide them.
+    """
+    @property
+    def game_state(self) -> GameState: ...
+
+    @property
+    def parent(self) -> typing.Optional['MctsNode']: ...
+
+    @property
+    def move(self) -> int | None: ...
+
+    @property
+    def children(self) -> typing.Optional[typing.Sequence['MctsNode']]: ...
+
+    @property
+    def child_predictions(self) -> np.ndarray | None: ...
+
+    @property
+    def average_value(self) -> float: ...
+
+    @property
+    def value_count(self) -> int: ...
+
+    @property
+    def child_moves(self) -> np.ndarray | None: ...
+
+    @property
+    def child_value_counts(self) -> np.ndarray | None: ...
+
+    @property
+    def child_average_values(self) -> np.ndarray | None: ...
+
+    def select_leaf(self, path: SearchPath | None = None) -> 'MctsNode': ...
+
+    def expand(self) -> None: ...
+
+    def get_child(self, child_index: int) -> 'MctsNode': ...
+
+    def find_all_children(self) -> typing.Sequence['MctsNode']: ...
+
+    def record_value(self,
+                     value: float,
+                     child_predictions: np.ndarray | None = None,
+                     path: SearchPath | None = None) -> None: ...
+
+    def evaluate(self,
+                 heuristic: Heuristic,
+                 path: SearchPath | None = None) -> None: ...
+
+    def choose_child_index(self, temperature: float) -> int: ...
+
+    def find_best_child_indexes(self) -> typing.List[int]: ...
+
 
 class SearchNode:
     # Controls exploration of new nodes vs. exploitation of good nodes.
     exploration_weight = 1.0
 
+    # When children have the same score, selection picks the first one.
+    # Set this to a random generator to pick one of them at random instead,
+    # and seed it to repeat a search exactly.
+    tie_generator: np.random.Generator | None = None
+
     def __init__(self,
                  game_state: GameState,
                  parent: typing.Optional['SearchNode'] = None,
@@ -34,11 +126,40 @@ class SearchNode:
         self.game_state = game_state
         self.parent = parent
         self.move = move
-        self.children: typing.Optional[typing.List[SearchNode]] = None
+        # Shares nodes for positions that different move orders reach.
+        self.transpositions: TranspositionTable | None = (
+            None if parent is None else parent.transpositions)
         self.child_predictions: typing.Optional[np.ndarray] = None
         self.average_value = 0.0
         self.value_count = 0
 
+        # The children's moves, value counts, average values and priors, in
+        # arrays for select_leaf() to score at once. The moves are None until
+        # expand() finds them, and each child node is only created when
+        # something asks for it, so unvisited children just have zeros in the
+        # arrays. See get_child().
+        self.child_moves: np.ndarray | None = None
+        self.child_nodes: typing.List[SearchNode | None] = []
+        self.child_value_counts: np.ndarray | None = None
+        self.child_average_values: np.ndarray | None = None
+        # Priors already multiplied by prior_weight.
+        self.child_priors: np.ndarray | float | None = None
+        self.prior_weight = 0.0
+        self.child_index = 0  # This node's entry in the parent's arrays.
+        # A node rebuilt after eviction has its old stats, but not the
+        # heuristic's predictions, so select_leaf() evaluates it again before
+        # choosing among its children.
+        self.is_rebuilt = False
+
+        # Values are for the player who moved here, so flip them unless the
+        # same player moves again.
+        if (parent is None or
+                parent.game_state.get_active_player() !=
+                game_state.get_active_player()):
+            self.value_sign = -1
+        else:
+            self.value_sign = 1
+
     def __repr__(self):
         return f"SearchNode({self.game_state!r})"
 
@@ -47,59 +168,183 @@ class SearchNode:
             return self.game_state == other.game_state
         return NotImplemented
 
-    def select_leaf(self):
-        if self.value_count == 0:
-            return self
-        children = self.find_all_children()
-        if not children:
-            return self
+    @property
+    def children(self) -> typing.Optional[typing.List['SearchNode']]:
+        """ The child nodes that have been created so far, or None if this
+        node hasn't been expanded. """
+        if self.child_moves is None:
+            return None
+        return [child for child in self.child_nodes if child is not None]
+
+    @children.setter
+    def children(self, children: typing.List['SearchNode']):
+        for child_index, child in enumerate(children):
+            child.child_index = child_index
+        self.child_nodes = list(children)
+        self.child_moves = np.array([child.move for child in children],
+                                    dtype=int)
+        self.child_value_counts = np.array(
+            [child.value_count for child in children],
+            dtype=np.int64)
+        self.child_average_values = np.array(
+            [child.average_value for child in children],
+            dtype=np.float64)
+        self.child_priors = None
+
+    def select_leaf(self, path: SearchPath | None = None) -> 'SearchNode':
+        """ Walk down from this node to the next leaf to evaluate.
+
+        :param path: a list to add (node, child_index) to for each step down,
+            so record_value() can follow the same path back up. Only needed
+            with transpositions, when a node can have more than one parent.
+        """
+        node = self
+        while node.value_count != 0 and not node.is_rebuilt:
+            if node.child_moves is None:
+                node.expand()
+            if not node.child_nodes:
+                break
+            average_values = node.child_average_values
+            value_counts = node.child_value_counts
+            assert average_values is not None
+            assert value_counts is not None
+            scores = (average_values +
+                      node.find_child_priors(self.exploration_weight) *
+                      math.sqrt(node.value_count) /
+                      (1 + value_counts))
+            child_index = self.find_best_index(scores)
+            if path is not None:
+                path.append((node, child_index))
+            node = node.get_child(child_index)
+        return node
+
+    @classmethod
+    def find_best_index(cls, scores: np.ndarray) -> int:
+        """ Find the highest score, and break any ties with tie_generator.
+        """
+        best_index = int(scores.argmax())
+        if cls.tie_generator is None:
+            return best_index
+        tied_indexes = np.flatnonzero(scores == scores[best_index])
+        if len(tied_indexes) == 1:
+            return best_index
+        return int(
+            tied_indexes[cls.tie_generator.integers(len(tied_indexes))])
+
+    def expand(self):
+        """ Find the valid moves, without creating any child nodes yet. """
+        if self.child_moves is not None:
+            return
+        if self.game_state.is_ended():
+            moves = np.zeros(0, dtype=int)
+        else:
+            moves = self.game_state.get_valid_move_indices()
+        self.child_moves = moves
+        self.child_nodes = [None] * len(moves)
+        self.child_value_counts = np.zeros(len(moves), dtype=np.int64)
+        self.child_average_values = np.zeros(len(moves), dtype=np.float64)
+        self.child_priors = None
+
+    def get_child(self, child_index: int) -> 'SearchNode':
+        """ Get a child node, creating it the first time it's needed. """
+        child = self.child_nodes[child_index]
+        if child is None:
+            assert self.child_moves is not None
+            move = int(self.child_moves[child_index])
+            child_state = self.game_state.step(move).state
+            if self.transpositions is not None:
+                child = self.transpositions.find_node(self, child_state)
+            if child is None:
+                child = SearchNode(child_state, self, move)
+                child.child_index = child_index
+                # After an eviction, the parent still has the old child's
+                # stats, so start from them.
+                assert self.child_value_counts is not None
+                assert self.child_average_values is not None
+                child.value_count = int(self.child_value_counts[child_index])
+                child.average_value = float(
+                    self.child_average_values[child_index])
+                child.is_rebuilt = child.value_count > 0
+                if self.transpositions is not None:
+                    self.transpositions.add_node(child)
+            self.child_nodes[child_index] = child
+        return child
 
-        best_score = float('-inf')
-        best_child = None
-        for child in children:
+    def find_child_priors(self, weight: float) -> np.ndarray | float:
+        """ Find the prior for each child, in the order of the children.
+
+        :param weight: the exploration weight to multiply the priors by
+        """
+        priors = self.child_priors
+        if priors is None or weight != self.prior_weight:
             if self.child_predictions is None:
-                prior = 1/len(children)
+                priors = weight * (1/len(self.child_nodes))
             else:
-                prior = self.child_predictions[child.move]
-            score = child.average_value + (self.exploration_weight * prior *
-                                           math.sqrt(self.value_count) /
-                                           (1 + child.value_count))
-            if score > best_score:
-                best_score = score
-                best_child = child
-        return best_child.select_leaf()
+                priors = weight * self.child_predictions[self.child_moves]
+            self.child_priors = priors
+            self.prior_weight = weight
+        return priors
 
     def find_all_children(self) -> typing.List['SearchNode']:
-        if self.children is not None:
-            return self.children
-        children: typing.List['SearchNode'] = []
-        if self.game_state.is_ended():
-            return children
-        for move, is_valid in enumerate(self.game_state.get_valid_moves()):
-            if is_valid:
-                child_state = self.game_state.make_move(move)
-                children.append(SearchNode(child_state, self, move))
-        self.children = children
-        return children
+        """ Get all the child nodes, creating any that are missing. """
+        self.expand()
+        return [self.get_child(child_index)
+                for child_index in range(len(self.child_nodes))]
 
-    def record_value(self,
-                     value: float,
-                     child_predictions: np.ndarray | None = None):
+    def record_value(
+            self,
+            value: float,
+            child_predictions: np.ndarray | None = None,
+            path: SearchPath | None = None):
+        """ Add a value to this node's average, and to its ancestors'.
+
+        :param value: the value for the player who moved to this node
+        :param child_predictions: the heuristic's policy for this node
+        :param path: the steps from select_leaf() that led here, or None to
+            follow parent links. Above the start of the path, values always
+            follow parent links.
+        """
         if child_predictions is not None:
             self.child_predictions = child_predictions
-        if (not self.parent or
-                self.parent.game_state.get_active_player() !=
-                self.game_state.get_active_player()):
-            value *= -1
-        self.average_value = ((self.average_value * self.value_count + value) /
-                              (self.value_count + 1))
-        self.value_count += 1
-        if self.parent:
-            self.parent.record_value(value)
-
-    def evaluate(self, heuristic: Heuristic):
+            self.child_priors = None
+            self.is_rebuilt = False
+        node: SearchNode | None = self
+        for parent, child_index in reversed(path or ()):
+            assert node is not None
+            value *= node.value_sign
+            node.average_value = ((node.average_value * node.value_count +
+                                   value) /
+                                  (node.value_count + 1))
+            node.value_count += 1
+            # A shared node has stats for all its parents, but each parent
+            # counts the visits through its own edge.
+            assert parent.child_value_counts is not None
+            assert parent.child_average_values is not None
+            edge_count = parent.child_value_counts[child_index]
+            parent.child_average_values[child_index] = (
+                (parent.child_average_values[child_index] * edge_count +
+                 value) /
+                (edge_count + 1))
+            parent.child_value_counts[child_index] = edge_count + 1
+            node = parent
+        while node is not None:
+            value *= node.value_sign
+            average_value = node.average_value = (
+                (node.average_value * node.value_count + value) /
+                (node.value_count + 1))
+            value_count = node.value_count = node.value_count + 1
+            parent_node = node.parent
+            if parent_node is not None:
+                assert parent_node.child_value_counts is not None
+                assert parent_node.child_average_values is not None
+                parent_node.child_value_counts[node.child_index] = value_count
+                parent_node.child_average_values[node.child_index] = (
+                    average_value)
+            node = parent_node
+
+    def evaluate(self, heuristic: Heuristic, path: SearchPath | None = None):
         value, child_predictions = heuristic.analyse(self.game_state)
-        self.record_value(value, child_predictions)
+        self.record_value(value, child_predictions, path)
 
     def choose_child(self, temperature: float) -> 'SearchNode':
         """ Choose a child randomly, ones with higher counts are more likely.
@@ -108,15 +353,26 @@ class SearchNode:
         choice is. The closer to zero, the more likely it is to choose the
         child with maximum count.
         """
-        children = self.find_all_children()
-        probabilities = self.rank_children(children, temperature)
-        child_count = len(children)
-        child_index = np.random.choice(child_count, p=probabilities)
-        return children[child_index]
+        return self.get_child(self.choose_child_index(temperature))
+
+    def choose_child_index(self, temperature: float) -> int:
+        """ Choose a child like choose_child(), but return its index. """
+        self.expand()
+        assert self.child_value_counts is not None
+        return self.choose_weighted_index(self.child_value_counts, temperature)
+
+    @classmethod
+    def choose_weighted_index(cls,
+                              value_counts: np.ndarray,
+                              temperature: float) -> int:
+        """ Choose an index randomly, weighted by rank_children(). """
+        probabilities = cls.rank_children(value_counts, temperature)
+        return int(np.random.choice(len(value_counts), p=probabilities))
 
     @staticmethod
-    def rank_children(children, temperature):
-        values = np.array([temperature * child.value_count for child in children])
+    def rank_children(value_counts: np.ndarray, temperature: float):
+        """ Turn the children's value counts into probabilities. """
+        values = temperature * np.asarray(value_counts, dtype=float)
 
         # Avoid overflow by keeping the weights between 0 and 1.
         values -= values.max(initial=0)
@@ -127,35 +383,514 @@ class SearchNode:
         return probabilities
 
     def find_best_children(self):
-        children = self.find_all_children()
-        best_value = float('-inf')
-        best_children = []
-        for child in children:
-            child_value = child.average_value
-            if child_value > best_value:
-                best_children = [child]
-                best_value = child_value
-            elif child_value == best_value:
-                best_children.append(child)
-        return best_children
+        return [self.get_child(child_index)
+                for child_index in self.find_best_child_indexes()]
+
+    def find_best_child_indexes(self) -> typing.List[int]:
+        """ Find the indexes of the children with the best average value. """
+        self.expand()
+        assert self.child_average_values is not None
+        return self.find_max_indexes(self.child_average_values)
+
+    @staticmethod
+    def find_max_indexes(average_values: np.ndarray) -> typing.List[int]:
+        """ Find all the indexes of the maximum value. """
+        if not len(average_values):
+            return []
+        return np.flatnonzero(
+            average_values == average_values.max()).tolist()
+
+
+class TranspositionTable:
+    """ Search nodes shared between the positions that different move orders
+    reach, so a search becomes a directed acyclic graph instead of a tree.
+
+    Nodes are keyed by their game state and the player who moved there, so a
+    shared node's values are always for the same player, even when a pass
+    lets one player reach a position that the other player can also reach.
+    A node only has one parent link, so record_value() needs the path from
+    select_leaf() to update the right parents. Repeated positions would make
+    cycles, but none of the games in this package can repeat a position.
+    """
+    def __init__(self):
+        self.nodes: typing.Dict[typing.Tuple[GameState, int], SearchNode] = {}
+        self.hit_count = 0  # Children that were found, instead of added.
+        self.miss_count = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def merge_rate(self) -> float:
+        """ The fraction of new children that merged with an existing node. """
+        total_count = self.hit_count + self.miss_count
+        if total_count == 0:
+            return math.nan
+        return self.hit_count / total_count
+
+    def find_node(self,
+                  parent: SearchNode,
+                  game_state: GameState) -> SearchNode | None:
+        """ Find an existing node for a position that parent can reach. """
+        key = (game_state, parent.game_state.get_active_player())
+        node = self.nodes.get(key)
+        if node is None:
+            self.miss_count += 1
+        else:
+            self.hit_count += 1
+        return node
+
+    def add_node(self, node: SearchNode):
+        assert node.parent is not None
+        key = (node.game_state, node.parent.game_state.get_active_player())
+        self.nodes[key] = node
+
+    def keep_nodes(self, nodes: typing.Iterable[SearchNode]):
+        """ Forget all the nodes that aren't in a list, after an eviction.
+        """
+        node_ids = {id(node) for node in nodes}
+        self.nodes = {key: node
+                      for key, node in self.nodes.items()
+                      if id(node) in node_ids}
+
+
+class SearchTree:
+    """ Search nodes stored in parallel arrays, instead of SearchNode objects.
+
+    Each node has an index, and the arrays hold its parent's index, the move
+    that led to it, its visit count and average value, the player to move,
+    and the range of its children, which are stored next to each other. The
+    arrays start small, and double in size when they fill up. Game states
+    and child predictions are in parallel lists. A child's game state, active
+    player and value sign are only filled in when find_state() first needs
+    them, usually when selection reaches it. ArraySearchNode wraps an index,
+    so SearchManager can use it in place of a SearchNode.
+
+    Selection and value updates follow the same steps as SearchNode, so a
+    search with the same random seed gives the same results.
+    """
+    def __init__(self, capacity: int = 1024):
+        self.node_count = 0
+        self.parents = np.zeros(capacity, dtype=np.int32)
+        self.moves = np.zeros(capacity, dtype=np.int32)
+        self.first_children = np.zeros(capacity, dtype=np.int32)
+        # Number of children, or -1 before the children are added.
+        self.child_counts = np.zeros(capacity, dtype=np.int32)
+        self.value_counts = np.zeros(capacity, dtype=np.int64)
+        self.average_values = np.zeros(capacity, dtype=np.float64)
+        self.active_players = np.zeros(capacity, dtype=np.int8)
+        # -1 if a node's values flip sign for its parent, otherwise 1.
+        self.value_signs = np.zeros(capacity, dtype=np.int8)
+        # None for a child until find_state() makes its state.
+        self.states: typing.List[GameState | None] = []
+        self.predictions: typing.List[np.ndarray | None] = []
+        # Each node's children's priors, multiplied by prior_weight.
+        self.child_priors: typing.List[np.ndarray | float | None] = []
+        self.prior_weight = 0.0
+        # The nodes that the last call to select_leaf() walked through.
+        self.path: typing.List[int] = []
+
+    def __len__(self):
+        return self.node_count
+
+    @property
+    def capacity(self) -> int:
+        return self.parents.size
+
+    def reserve(self, node_count: int):
+        """ Grow the arrays, if needed, to hold node_count nodes. """
+        capacity = self.capacity
+        if node_count <= capacity:
+            return
+        while capacity < node_count:
+            capacity *= 2
+        for name in ('parents',
+                     'moves',
+                     'first_children',
+                     'child_counts',
+                     'value_counts',
+                     'average_values',
+                     'active_players',
+                     'value_signs'):
+            old_array = getattr(self, name)
+            new_array = np.zeros(capacity, dtype=old_array.dtype)
+            new_array[:old_array.size] = old_array
+            setattr(self, name, new_array)
+
+    def add_root(self, game_state: GameState) -> int:
+        """ Throw away all the nodes, and start again from a new root.
+
+        :return: the new root's index, which is always 0.
+        """
+        self.node_count = 0
+        self.states.clear()
+        self.predictions.clear()
+        self.child_priors.clear()
+        self.path.clear()
+        self.reserve(1)
+        self.parents[0] = self.moves[0] = -1
+        self.child_counts[0] = -1
+        self.value_counts[0] = 0
+        self.average_values[0] = 0.0
+        self.active_players[0] = game_state.get_active_player()
+        self.value_signs[0] = -1
+        self.states.append(game_state)
+        self.predictions.append(None)
+        self.child_priors.append(None)
+        self.node_count = 1
+        return 0
+
+    def find_all_children(self, node: int) -> range:
+        """ Add a node's children, if they haven't been added yet.
+
+        :return: the children's indexes
+        """
+        child_count = self.child_counts[node]
+        if child_count >= 0:
+            start = self.first_children[node]
+            return range(start, start + child_count)
+        game_state = self.find_state(node)
+        if game_state.is_ended():
+            moves = np.zeros(0, dtype=int)
+        else:
+            moves = game_state.get_valid_move_indices()
+        child_count = len(moves)
+        start = self.node_count
+        end = start + child_count
+        self.reserve(end)
+        self.parents[start:end] = node
+        self.moves[start:end] = moves
+        self.child_counts[start:end] = -1
+        self.value_counts[start:end] = 0
+        self.average_values[start:end] = 0.0
+        self.states.extend([None] * child_count)
+        self.predictions.extend([None] * child_count)
+        self.child_priors.extend([None] * child_count)
+        self.first_children[node] = start
+        self.child_counts[node] = child_count
+        self.node_count = end
+        return range(start, end)
+
+    def find_state(self, node: int) -> GameState:
+        """ Get a node's game state, making it from the parent's if needed.
+        """
+        game_state = self.states[node]
+        if game_state is None:
+            parent = self.parents[node]
+            parent_state = self.states[parent]
+            assert parent_state is not None
+            transition = parent_state.step(int(self.moves[node]))
+            game_state = self.states[node] = transition.state
+            self.active_players[node] = transition.active_player
+            self.value_signs[node] = (
+                1 if transition.active_player == self.active_players[parent]
+                else -1)
+        return game_state
+
+    def promote(self, node: int) -> np.ndarray:
+        """ Keep only a node and its descendants, with the node as the root.
+
+        The kept nodes move to the front of the arrays, in the same order.
+        :return: each old node's new index, or -1 if it was dropped. The new
+            root's index is always 0.
+        """
+        child_counts = self.child_counts[:self.node_count].tolist()
+        first_children = self.first_children[:self.node_count].tolist()
+        old_indexes = [node]
+        new_first_children = []
+        for old_index in old_indexes:  # Grows as children are added.
+            child_count = child_counts[old_index]
+            if child_count > 0:
+                start = first_children[old_index]
+                new_first_children.append(len(old_indexes))
+                old_indexes.extend(range(start, start + child_count))
+            else:
+                new_first_children.append(0)
+        kept = np.array(old_indexes)
+        new_count = len(old_indexes)
+        new_indexes = np.full(self.node_count, -1, dtype=np.int32)
+        new_indexes[kept] = np.arange(new_count)
+
+        parents = new_indexes[self.parents[kept]]
+        parents[0] = -1
+        self.parents[:new_count] = parents
+        self.first_children[:new_count] = new_first_children
+        for name in ('moves',
+                     'child_counts',
+                     'value_counts',
+                     'average_values',
+                     'active_players',
+                     'value_signs'):
+            array = getattr(self, name)
+            array[:new_count] = array[kept]
+        self.moves[0] = -1
+        for name in ('states', 'predictions', 'child_priors'):
+            values = getattr(self, name)
+            values[:] = [values[old_index] for old_index in old_indexes]
+        self.node_count = new_count
+        self.path.clear()
+        return new_indexes
+
+    def select_leaf(self, node: int) -> int:
+        """ Walk down from a node to the next leaf to evaluate.
+
+        The nodes along the way are saved in path, for record_value().
+        """
+        weight = SearchNode.exploration_weight
+        if weight != self.prior_weight:
+            self.child_priors = [None] * self.node_count
+            self.prior_weight = weight
+        path = self.path
+        path.clear()
+        path.append(node)
+        while self.value_counts[node] != 0:
+            children = self.find_all_children(node)
+            if not children:
+                break
+            # Adding children can replace the arrays, so look them up after.
+            value_counts = self.value_counts
+            start, end = children.start, children.stop
+            priors = self.child_priors[node]
+            if priors is None:
+                predictions = self.predictions[node]
+                if predictions is None:
+                    priors = weight * (1/len(children))
+                else:
+                    priors = weight * predictions[self.moves[start:end]]
+                self.child_priors[node] = priors
+            scores = (self.average_values[start:end] +
+                      priors *
+                      math.sqrt(value_counts[node]) /
+                      (1 + value_counts[start:end]))
+            node = start + SearchNode.find_best_index(scores)
+            path.append(node)
+        self.find_state(node)
+        return node
+
+    def record_value(self,
+                     node: int,
+                     value: float,
+                     child_predictions: np.ndarray | None = None):
+        """ Add a value to a node's average, and to its ancestors' averages.
+        """
+        self.find_state(node)  # Sets the value sign.
+        if child_predictions is not None:
+            self.predictions[node] = child_predictions
+            self.child_priors[node] = None
+        path = self.path
+        if path and path[-1] == node:
+            # Reuse the last selection, then add the nodes above it.
+            path_nodes = path[::-1]
+        else:
+            path_nodes = [node]
+        parent = self.parents[path_nodes[-1]]
+        while parent >= 0:
+            path_nodes.append(parent)
+            parent = self.parents[parent]
+
+        # Update the whole path at once.
+        nodes = np.array(path_nodes)
+        values = value * np.cumprod(self.value_signs[nodes])
+        value_counts = self.value_counts[nodes]
+        self.average_values[nodes] = (
+            (self.average_values[nodes] * value_counts + values) /
+            (value_counts + 1))
+        self.value_counts[nodes] = value_counts + 1
+
+
+class ArraySearchNode:
+    """ One node in a SearchTree, with the MctsNode interface. """
+    def __init__(self, tree: SearchTree, index: int):
+        # Everything else comes from the tree.
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return f"ArraySearchNode({self.game_state!r})"
+
+    def __eq__(self, other):
+        if isinstance(other, ArraySearchNode):
+            return self.game_state == other.game_state
+        return NotImplemented
+
+    @property
+    def game_state(self) -> GameState:
+        return self.tree.find_state(self.index)
+
+    @property
+    def parent(self) -> typing.Optional['ArraySearchNode']:
+        parent = int(self.tree.parents[self.index])
+        if parent < 0:
+            return None
+        return ArraySearchNode(self.tree, parent)
+
+    @property
+    def move(self) -> int | None:
+        if self.tree.parents[self.index] < 0:
+            return None
+        return int(self.tree.moves[self.index])
+
+    @property
+    def children(self) -> typing.Optional[typing.List['ArraySearchNode']]:
+        if self.tree.child_counts[self.index] < 0:
+            return None
+        return self.find_all_children()
+
+    @property
+    def child_predictions(self) -> np.ndarray | None:
+        return self.tree.predictions[self.index]
+
+    @property
+    def average_value(self) -> float:
+        return float(self.tree.average_values[self.index])
+
+    @property
+    def value_count(self) -> int:
+        return int(self.tree.value_counts[self.index])
+
+    @property
+    def child_moves(self) -> np.ndarray | None:
+        return self.slice_children(self.tree.moves)
+
+    @property
+    def child_value_counts(self) -> np.ndarray | None:
+        return self.slice_children(self.tree.value_counts)
+
+    @property
+    def child_average_values(self) -> np.ndarray | None:
+        return self.slice_children(self.tree.average_values)
+
+    def slice_children(self, array: np.ndarray) -> np.ndarray | None:
+        """ Get the children's entries from one of the tree's arrays. """
+        child_count = self.tree.child_counts[self.index]
+        if child_count < 0:
+            return None
+        start = self.tree.first_children[self.index]
+        return array[start:start+child_count]
+
+    def select_leaf(self,
+                    path: SearchPath | None = None) -> 'ArraySearchNode':
+        # The tree has no transpositions, so parent links are enough.
+        return ArraySearchNode(self.tree, self.tree.select_leaf(self.index))
+
+    def expand(self) -> None:
+        self.tree.find_all_children(self.index)
+
+    def get_child(self, child_index: int) -> 'ArraySearchNode':
+        tree = self.tree
+        return ArraySearchNode(
+            tree,
+            int(tree.first_children[self.index]) + child_index)
+
+    def find_all_children(self) -> typing.List['ArraySearchNode']:
+        return [ArraySearchNode(self.tree, child)
+                for child in self.tree.find_all_children(self.index)]
+
+    def record_value(self,
+                     value: float,
+                     child_predictions: np.ndarray | None = None,
+                     path: SearchPath | None = None) -> None:
+        self.tree.record_value(self.index, value, child_predictions)
+
+    def evaluate(self,
+                 heuristic: Heuristic,
+                 path: SearchPath | None = None) -> None:
+        value, child_predictions = heuristic.analyse(self.game_state)
+        self.record_value(value, child_predictions)
+
+    def choose_child_index(self, temperature: float) -> int:
+        self.expand()
+        assert self.child_value_counts is not None
+        return SearchNode.choose_weighted_index(self.child_value_counts,
+                                                temperature)
+
+    def find_best_child_indexes(self) -> typing.List[int]:
+        self.expand()
+        assert self.child_average_values is not None
+        return SearchNode.find_max_indexes(self.child_average_values)
 
 
 class SearchManager:
+    # How many moves down find_node() looks for a node to reuse.
+    reuse_depth = 2
+
+    # Each eviction drops this fraction of max_nodes more than it needs to,
+    # so the next one can wait for that many new nodes.
+    eviction_margin = 0.1
+
     def __init__(self, start_state: GameState,
                  heuristic: Heuristic,
-                 process_count: int = 1):
+                 process_count: int = 1,
+                 use_array_tree: bool = False,
+                 use_transpositions: bool = False,
+                 max_nodes: int | None = None):
+        """ Initialize an instance.
+
+        :param start_state: the board state at the start of each game
+        :param heuristic: evaluates leaf positions
+        :param process_count: number of processes to evaluate leaves in, or
+            1 to evaluate them in this process
+        :param use_array_tree: True to store the search nodes in a
+            SearchTree, instead of SearchNode objects
+        :param use_transpositions: True to share SearchNode objects between
+            move orders that reach the same position, with a
+            TranspositionTable
+        :param max_nodes: the most SearchNode objects to keep, or None for
+            no limit. search() checks the limit after each iteration, and
+            evict_nodes() drops the least visited nodes. Their parents keep their counts
+            and averages, so a byte budget can be turned into a node limit
+            with the bytes per node from zero_perf --memory.
+        """
+        if use_array_tree and use_transpositions:
+            raise ValueError(
+                'Transpositions need SearchNode objects, not an array tree.')
+        if use_transpositions and type(start_state).__hash__ is None:
+            raise ValueError(
+                f'Transpositions need hashable game states, but '
+                f'{type(start_state).__name__} has no __hash__().')
+        if use_array_tree and max_nodes is not None:
+            raise ValueError(
+                'Node limits need SearchNode objects, not an array tree.')
         self.start_state = start_state
-        self.heuristic = heuristic
-        self.current_node = self.reset()
         self.process_count = process_count
-        if process_count <= 1:
-            self.executor = None
-        else:
-            self.executor = ProcessPoolExecutor(process_count)
-        self.tasks: typing.Dict[Future, SearchNode] = {}
+        self.tree = SearchTree() if use_array_tree else None
+        self.use_transpositions = use_transpositions
+        self.transpositions: TranspositionTable | None = None
+        self.max_nodes = max_nodes
+        self.eviction_count = 0  # Number of searches that evicted nodes.
+        self.evicted_node_count = 0
+        # At least the number of nodes, see search() and evict_nodes().
+        self.node_count_bound = 0
+        self.executor: ProcessPoolExecutor | None = None
+        self.heuristic = heuristic  # Starts the executor.
+        self.current_node = self.reset()
+        # {future: (leaf, path)}
+        self.tasks: typing.Dict[
+            Future,
+            typing.Tuple[MctsNode, SearchPath | None]
+        ] = {}
         self.search_count = 0
         self.total_iterations = 0
         self.total_milliseconds = 0
+        self.inherited_visits = 0  # Reused at the start of the last search.
+        self.total_inherited_visits = 0
+
+    @property
+    def heuristic(self) -> Heuristic:
+        return self._heuristic
+
+    @heuristic.setter
+    def heuristic(self, value: Heuristic):
+        self._heuristic = value
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.process_count > 1:
+            # Each worker process gets its own copy of the heuristic.
+            self.executor = ProcessPoolExecutor(self.process_count,
+                                                initializer=start_worker,
+                                                initargs=(value,
+                                                          self.start_state))
 
     @property
     def average_iterations(self) -> float:
@@ -169,25 +904,107 @@ class SearchManager:
             return math.nan
         return self.total_milliseconds / self.search_count
 
+    @property
+    def node_count(self) -> int:
+        """ The number of nodes still connected to the current node. """
+        if self.tree is not None:
+            return self.tree.node_count
+        nodes, _ = self.find_all_nodes()
+        return len(nodes)
+
+    @property
+    def average_inherited_visits(self) -> float:
+        if self.search_count == 0:
+            return math.nan
+        return self.total_inherited_visits / self.search_count
+
     def reset_counts(self) -> None:
         self.search_count = self.total_milliseconds = self.total_iterations = 0
+        self.total_inherited_visits = 0
 
-    def reset(self) -> SearchNode:
-        self.current_node = SearchNode(self.start_state)
+    def reset(self) -> MctsNode:
+        self.current_node = self.create_root(self.start_state)
         return self.current_node
 
+    def create_root(self, game_state: GameState) -> MctsNode:
+        """ Start a new search tree. """
+        if self.tree is not None:
+            return ArraySearchNode(self.tree, self.tree.add_root(game_state))
+        self.node_count_bound = 0  # The root gets counted when it's selected.
+        root = SearchNode(game_state)
+        if self.use_transpositions:
+            self.transpositions = root.transpositions = TranspositionTable()
+        return root
+
     def find_node(self, game_state: GameState):
-        if not game_state == self.current_node.game_state:
-            for child in self.current_node.find_all_children():
-                if game_state == child.game_state:
-                    self.current_node = child
-                    break
-            else:
-                parent = self.current_node.parent
-                if parent is not None and game_state == parent.game_state:
-                    self.current_node = parent
-                else:
-                    self.current_node = SearchNode(game_state)
+        """ Make the current node match a position, reusing old searches.
+
+        Look at the current node, its descendants down to reuse_depth moves,
+        and its parent, which is still linked after move_to_child(). A
+        matching node becomes the root, and the rest of the tree is released.
+        Otherwise, like after stepping back past the root, start a new tree
+        and search again from there. Either way, set inherited_visits to the
+        new current node's value count.
+        """
+        node = self.current_node
+        if game_state == node.game_state:
+            match: MctsNode | None = node
+        else:
+            match = self.find_descendant(game_state)
+            parent = node.parent
+            if (match is None and
+                    parent is not None and
+                    game_state == parent.game_state):
+                match = parent
+        if match is None:
+            self.current_node = self.create_root(game_state)
+        else:
+            self.promote(match)
+        self.inherited_visits = self.current_node.value_count
+
+    def find_descendant(self, game_state: GameState) -> MctsNode | None:
+        """ Look for a position below the current node.
+
+        Only nodes that have been visited are checked, because an unvisited
+        node is no better than a new root.
+        """
+        nodes = [self.current_node]
+        for _ in range(self.reuse_depth):
+            nodes = [child
+                     for node in nodes
+                     for child in node.children or ()
+                     if child.value_count > 0]
+            for node in nodes:
+                if game_state == node.game_state:
+                    return node
+        return None
+
+    def promote(self, node: MctsNode):
+        """ Make a node the current node and the root of the search tree.
+
+        Cutting the parent link lets the garbage collector free the node's
+        ancestors and their other descendants.
+        """
+        if node.parent is None:
+            self.current_node = node  # Already the root.
+            return
+        if self.tree is not None:
+            assert isinstance(node, ArraySearchNode)
+            new_indexes = self.tree.promote(node.index)
+            self.current_node = ArraySearchNode(self.tree,
+                                                int(new_indexes[node.index]))
+            return
+        assert isinstance(node, SearchNode)
+        node.parent = None
+        self.current_node = node
+        if self.transpositions is not None:
+            # Shared nodes might still link to a parent outside the new tree.
+            nodes, links = self.find_all_nodes()
+            node_ids = {id(node) for node in nodes}
+            for child in nodes[1:]:
+                if id(child.parent) not in node_ids:
+                    child.parent, child.child_index = links[id(child)][0]
+            self.transpositions.keep_nodes(nodes)
 
     def search(self,
                board: GameState,
@@ -195,21 +1012,31 @@ class SearchManager:
                milliseconds: int | None = None):
         start_time = datetime.now()
         self.find_node(board)
+        self.total_inherited_visits += self.inherited_visits
         max_tasks = self.process_count * 2
         iteration = 0
         for iteration in count(1):
-            leaf = self.current_node.select_leaf()
+            path: SearchPath | None = (
+                [] if self.transpositions is not None else None)
+            leaf = self.current_node.select_leaf(path)
+            if self.max_nodes is not None and leaf.child_moves is None:
+                # A new or rebuilt node, or one that is still waiting for its
+                # evaluation, so this can overcount.
+                self.node_count_bound += 1
             if self.executor is None:
-                leaf.evaluate(self.heuristic)
+                leaf.evaluate(self.heuristic, path)
             else:
-                future = self.executor.submit(self.heuristic.analyse,
-                                              leaf.game_state)
-                self.tasks[future] = leaf
+                future = self.executor.submit(analyse_bytes,
+                                              leaf.game_state.to_bytes())
+                self.tasks[future] = (leaf, path)
                 if len(self.tasks) >= max_tasks:
                     timeout = None
                 else:
                     timeout = 0
                 self.check_tasks(timeout, return_when=FIRST_COMPLETED)
+            if (self.max_nodes is not None and
+                    self.node_count_bound > self.max_nodes):
+                self.evict_nodes()
             if iterations is not None:
                 if iteration >= iterations:
                     break
@@ -221,34 +1048,122 @@ class SearchManager:
         if self.tasks:
             self.check_tasks(timeout=None, return_when=ALL_COMPLETED)
 
-        if self.current_node.children is None:
-            self.current_node.select_leaf()
+        self.current_node.expand()
         self.search_count += 1
         self.total_iterations += iteration
         spent_ms = (datetime.now() - start_time).total_seconds() * 1000
         self.total_milliseconds += round(spent_ms)
 
+    def find_all_nodes(self) -> typing.Tuple[
+            typing.List[SearchNode],
+            typing.Dict[int, SearchPath]]:
+        """ Find all the nodes that are still connected to the current node.
+
+        The search starts from the current node's oldest ancestor, because the
+        parent links keep the earlier moves' nodes alive.
+        :return: (nodes, links) where links is {id(node): [(parent,
+            child_index)]} for the edges down to each node
+        """
+        top_node = self.current_node
+        assert isinstance(top_node, SearchNode)
+        while top_node.parent is not None:
+            top_node = top_node.parent
+        nodes = [top_node]
+        links: typing.Dict[int, SearchPath] = {id(top_node): []}
+        pending_nodes = [top_node]
+        while pending_nodes:
+            node = pending_nodes.pop()
+            for child_index, child in enumerate(node.child_nodes):
+                if child is None:
+                    continue
+                child_links = links.get(id(child))
+                if child_links is None:
+                    child_links = links[id(child)] = []
+                    nodes.append(child)
+                    pending_nodes.append(child)
+                child_links.append((node, child_index))
+        return nodes, links
+
+    def evict_nodes(self):
+        """ Drop the least visited nodes, to get eviction_margin below
+        max_nodes.
+
+        Only nodes without any child nodes are dropped, so each one removes
+        exactly one node, and the rest of the tree stays connected. An
+        evicted node's parent keeps its count and average, and get_child()
+        rebuilds the node from them if the search comes back to it. The
+        current node, its ancestors, and leaves that are waiting for an
+        evaluation are never evicted.
+        """
+        assert self.max_nodes is not None
+        nodes, links = self.find_all_nodes()
+        margin = max(1, int(self.max_nodes * self.eviction_margin))
+        excess_count = len(nodes) - (self.max_nodes - margin)
+        if excess_count <= 0:
+            self.node_count_bound = len(nodes)
+            return
+        kept_ids = {id(leaf) for leaf, _ in self.tasks.values()}
+        node: MctsNode | None = self.current_node
+        while node is not None:
+            kept_ids.add(id(node))
+            node = node.parent
+        child_counts = dict.fromkeys(links, 0)
+        for node_links in links.values():
+            for parent, _ in node_links:
+                child_counts[id(parent)] += 1
+        value_counts = [node.value_count for node in nodes]
+        # find_all_nodes() lists parents before their children, so breaking
+        # ties with the later node reaches the children first.
+        node_order = np.lexsort((-np.arange(len(nodes)), value_counts))
+        dropped_ids = set()
+        for node_index in node_order.tolist():
+            node = nodes[node_index]
+            if id(node) in kept_ids or child_counts[id(node)]:
+                continue
+            for parent, child_index in links[id(node)]:
+                parent.child_nodes[child_index] = None
+                child_counts[id(parent)] -= 1
+            dropped_ids.add(id(node))
+            if len(dropped_ids) >= excess_count:
+                break
+
+        self.node_count_bound = len(nodes) - len(dropped_ids)
+        self.evicted_node_count += len(dropped_ids)
+        self.eviction_count += 1
+        if self.transpositions is not None:
+            self.transpositions.keep_nodes(node
+                                           for node in nodes
+                                           if id(node) not in dropped_ids)
+
     def check_tasks(self, timeout, return_when):
         done, not_done = wait(self.tasks.keys(),
                               timeout,
                               return_when=return_when)
         for done_future in done:
-            done_leaf = self.tasks.pop(done_future)
+            done_leaf, path = self.tasks.pop(done_future)
             value, child_predictions = done_future.result()
-            done_leaf.record_value(value, child_predictions)
+            done_leaf.record_value(value, child_predictions, path)
 
     def get_best_move(self) -> int:
-        best_children = self.current_node.find_best_children()
-        # noinspection PyTypeChecker
-        self.current_node = child = np.random.choice(best_children)
-        assert child.move is not None
-        return child.move
+        node = self.current_node
+        child_index = np.random.choice(node.find_best_child_indexes())
+        return self.move_to_child(child_index)
 
     def choose_weighted_move(self) -> int:
         temperature = 1.0
-        self.current_node = child = self.current_node.choose_child(temperature)
-        assert child.move is not None
-        return child.move
+        child_index = self.current_node.choose_child_index(temperature)
+        return self.move_to_child(child_index)
+
+    def move_to_child(self, child_index: int) -> int:
+        """ Make a child the current node.
+
+        :return: the move from the old current node, which can be different
+            from the child's own move, if it was shared with another parent.
+        """
+        node = self.current_node
+        assert node.child_moves is not None
+        self.current_node = node.get_child(child_index)
+        return int(node.child_moves[child_index])
 
     def get_move_probabilities(
             self,
@@ -266,21 +1181,28 @@ class SearchManager:
         and avg_value is the average value from all those probes.
         """
         self.find_node(game_state)
-        children = self.current_node.find_all_children()
+        node = self.current_node
+        node.expand()
+        assert node.child_moves is not None
+        assert node.child_value_counts is not None
+        assert node.child_average_values is not None
         temperature = 1.0
-        probabilities = self.current_node.rank_children(children, temperature)
-        value_counts = [child.value_count for child in children]
-        ranked_children = sorted(zip(value_counts, probabilities, children),
+        probabilities = SearchNode.rank_children(node.child_value_counts,
+                                                 temperature)
+        # Unvisited children just have zero counts, so don't create them.
+        ranked_children = sorted(zip(node.child_value_counts.tolist(),
+                                     probabilities.tolist(),
+                                     node.child_moves.tolist(),
+                                     node.child_average_values.tolist()),
                                  key=itemgetter(0),
                                  reverse=True)
         top_children = ranked_children[:limit]
-        child_node: SearchNode
-        top_moves = [(game_state.display_move(child_node.move),
+        top_moves = [(game_state.display_move(move),
                       probability,
                       value_count,
-                      child_node.average_value)
-                     for value_count, probability, child_node in top_children
-                     if child_node.move is not None]
+                      average_value)
+                     for value_count, probability, move, average_value
+                     in top_children]
         return top_moves
 
     def create_training_data(
@@ -313,21 +1235,18 @@ class SearchManager:
             self.search(self.current_node.game_state,
                         iterations=iterations,
                         milliseconds=milliseconds)
-            assert self.current_node.children is not None
-            assert self.current_node.child_predictions is not None
-            move_weights = np.zeros(self.current_node.child_predictions.size)
-            for child in self.current_node.children:
-                move = child.move
-                move_weights[move] = child.value_count
+            node = self.current_node
+            assert node.child_moves is not None
+            assert node.child_predictions is not None
+            move_weights = np.zeros(node.child_predictions.size)
+            move_weights[node.child_moves] = node.child_value_counts
             total_weight = move_weights.sum()
             if total_weight:
                 move_weights /= total_weight
-            game_states.append((self.current_node.game_state, move_weights))
+            game_states.append((node.game_state, move_weights))
             move = np.random.choice(move_weights.size, p=move_weights)
-            for child in self.current_node.children:
-                if child.move == move:
-                    self.current_node = child
-                    break
+            child_index = np.flatnonzero(node.child_moves == move)[0]
+            self.current_node = node.get_child(int(child_index))
             if self.current_node.game_state.is_ended():
                 final_value, _ = self.heuristic.analyse(self.current_node.game_state)
                 final_player = -self.current_node.game_state.get_active_player()
@@ -370,7 +1289,10 @@ class MctsPlayer(Player):
                  iteration_count: int | None = None,
                  milliseconds: int | None = None,
                  heuristic: Heuristic | None = None,
-                 process_count: int = 1):
+                 process_count: int = 1,
+                 use_array_tree: bool = False,
+                 use_transpositions: bool = False,
+                 max_nodes: int | None = None):
         super().__init__(player_number, heuristic)
         self.milliseconds = milliseconds
         if milliseconds is None and iteration_count is None:
@@ -379,7 +1301,10 @@ class MctsPlayer(Player):
             self.iteration_count = iteration_count
         self.search_manager = SearchManager(start_state,
                                             self.heuristic,
-                                            process_count)
+                                            process_count,
+                                            use_array_tree,
+                                            use_transpositions,
+                                            max_nodes)
 
     @property
     def heuristic(self) -> Heuristic:
@@ -403,6 +1328,10 @@ class MctsPlayer(Player):
     def average_milliseconds(self) -> float:
         return self.search_manager.average_milliseconds
 
+    @property
+    def average_inherited_visits(self) -> float:
+        return self.search_manager.average_inherited_visits
+
     def end_game(self, game_state: GameState, opponent: Player):
         self.search_manager.reset()
 
@@ -1,13 +1,176 @@
 import typing
 from copy import copy
+from dataclasses import dataclass
+from functools import cache
 
 import numpy as np
 
-from zero_play.game_state import GridGameState
+from zero_play.game_state import (BitboardGameState, BitboardCursor,
+                                  find_bit_indexes, memoized, ArrayBatch,
+                                  GameState, GridGeometry, Transition)
 
 
-class OthelloState(GridGameState):
+@dataclass(frozen=True)
+class OthelloStatus:
+    """ Everything the search needs to know about a position's moves. """
+    move_spaces: int  # bit mask of the spaces where the active player can move
+    is_pass_allowed: bool
+    is_ended: bool
+    winner: int
+
+
+class OthelloRules:
+    """ Othello move generation for one board size, using bitboard shifts.
+
+    Bit number row*board_width + column is set when a player has a piece in
+    that space, as in BitboardGameState. Moving every piece one step in a
+    direction is a single shift of the whole bit mask, followed by a mask that
+    clears the pieces that wrapped around to the other edge of the board.
+    Use get() to find the single instance for each board size.
+    """
+    DIRECTIONS = tuple((di, dj)
+                       for di in range(-1, 2)
+                       for dj in range(-1, 2)
+                       if di or dj)
+
+    def __init__(self, geometry: GridGeometry):
+        self.geometry = geometry
+        board_height = geometry.board_height
+        board_width = geometry.board_width
+        space_count = geometry.space_count
+        first_column = sum(1 << (i*board_width) for i in range(board_height))
+        last_column = first_column << (board_width - 1)
+
+        # [(shift_size, mask)] for directions that shift left or right
+        self.left_shifts: typing.List[typing.Tuple[int, int]] = []
+        self.right_shifts: typing.List[typing.Tuple[int, int]] = []
+        for di, dj in self.DIRECTIONS:
+            mask = geometry.full_mask
+            if dj == 1:
+                mask &= ~first_column
+            elif dj == -1:
+                mask &= ~last_column
+            shift_size = di*board_width + dj
+            if shift_size > 0:
+                self.left_shifts.append((shift_size, mask))
+            else:
+                self.right_shifts.append((-shift_size, mask))
+
+        # A run of opponent pieces can't reach either edge, so the first step
+        # and this many more will find the longest run.
+        self.run_steps = range(max(board_height, board_width) - 3)
+
+        # ray_spaces[space, direction] lists the spaces in a line from that
+        # space to the edge of the board, padded with space_count. The extra
+        # row for space_count is all padding, so a pass has no rays.
+        ray_size = max(board_height, board_width)
+        ray_spaces = np.full((space_count + 1, len(self.DIRECTIONS), ray_size),
+                             space_count)
+        # ray_bits[space] has a tuple of single bits for each line that is
+        # long enough to flip something.
+        self.ray_bits: typing.List[typing.Tuple[typing.Tuple[int, ...], ...]] = []
+        for space in range(space_count):
+            start_row, start_column = divmod(space, board_width)
+            space_rays = []
+            for direction, (di, dj) in enumerate(self.DIRECTIONS):
+                ray = []
+                i = start_row + di
+                j = start_column + dj
+                while 0 <= i < board_height and 0 <= j < board_width:
+                    ray.append(i*board_width + j)
+                    i += di
+                    j += dj
+                ray_spaces[space, direction, :len(ray)] = ray
+                if len(ray) > 1:
+                    space_rays.append(tuple(1 << ray_space
+                                            for ray_space in ray))
+            self.ray_bits.append(tuple(space_rays))
+        ray_spaces.flags.writeable = False
+        self.ray_spaces = ray_spaces
+
+    @staticmethod
+    @cache
+    def get(geometry: GridGeometry) -> 'OthelloRules':
+        """ Get the shared instance for a board size. """
+        return OthelloRules(geometry)
+
+    def find_move_spaces(self, player_bits: int, opponent_bits: int) -> int:
+        """ Bit mask of the spaces where a player could move.
+
+        Flood out from the player's pieces across runs of opponent pieces in
+        every direction at once, and keep the empty spaces just past a run.
+        """
+        empty_spaces = self.geometry.full_mask & ~(player_bits | opponent_bits)
+        run_steps = self.run_steps
+        move_spaces = 0
+        for shift_size, mask in self.left_shifts:
+            targets = opponent_bits & mask
+            runs = (player_bits << shift_size) & targets
+            for _ in run_steps:
+                runs |= (runs << shift_size) & targets
+            move_spaces |= (runs << shift_size) & mask
+        for shift_size, mask in self.right_shifts:
+            targets = opponent_bits & mask
+            runs = (player_bits >> shift_size) & targets
+            for _ in run_steps:
+                runs |= (runs >> shift_size) & targets
+            move_spaces |= (runs >> shift_size) & mask
+        return move_spaces & empty_spaces
+
+    def find_flips(self, player_bits: int, opponent_bits: int, space: int) -> int:
+        """ Find the opponent's pieces that a move in a space would flip. """
+        flips = 0
+        for ray in self.ray_bits[space]:
+            run = 0
+            for bit in ray:
+                if bit & opponent_bits:
+                    run |= bit
+                    continue
+                if bit & player_bits:
+                    flips |= run
+                break
+        return flips
+
+    def find_winner(self, x_bits: int, o_bits: int) -> int:
+        """ Compare piece counts, without checking that the game ended. """
+        x_total = x_bits.bit_count()
+        o_total = o_bits.bit_count()
+        if x_total > o_total:
+            return OthelloState.X_PLAYER
+        if x_total < o_total:
+            return OthelloState.O_PLAYER
+        return OthelloState.NO_PLAYER
+
+    def find_status(self, x_bits: int, o_bits: int, player: int) -> OthelloStatus:
+        """ Check moves, passing, and the end of the game in one pass.
+
+        The opponent's moves are only checked when the player has none.
+        """
+        if player == OthelloState.X_PLAYER:
+            player_bits, opponent_bits = x_bits, o_bits
+        else:
+            player_bits, opponent_bits = o_bits, x_bits
+        move_spaces = self.find_move_spaces(player_bits, opponent_bits)
+        if move_spaces:
+            return OthelloStatus(move_spaces,
+                                 is_pass_allowed=False,
+                                 is_ended=False,
+                                 winner=OthelloState.NO_PLAYER)
+        if self.find_move_spaces(opponent_bits, player_bits):
+            return OthelloStatus(0,
+                                 is_pass_allowed=True,
+                                 is_ended=False,
+                                 winner=OthelloState.NO_PLAYER)
+        return OthelloStatus(0,
+                             is_pass_allowed=False,
+                             is_ended=True,
+                             winner=self.find_winner(x_bits, o_bits))
+
+
+class OthelloState(BitboardGameState):
+    __slots__ = ('active_player', '_status')
     game_name = 'Othello'
+    symmetry = 'dihedral'
 
     def __init__(self,
                  text: str | None = None,
@@ -22,7 +185,6 @@ class OthelloState(GridGameState):
         super().__init__(board_height,
                          board_width,
                          lines=lines)
-        spaces = self.spaces
         if text:
             assert next_player_line and next_player_line.startswith('>')
             self.active_player = (self.X_PLAYER
@@ -30,6 +192,7 @@ class OthelloState(GridGameState):
                                   else self.O_PLAYER)
         else:
             self.active_player = self.X_PLAYER
+            spaces = self.mutable_spaces()
             for i in range(self.board_height//2-1, self.board_height//2+1):
                 for j in range(self.board_width//2-1, self.board_width//2+1):
                     player = self.X_PLAYER if (i+j) % 2 else self.O_PLAYER
@@ -40,53 +203,70 @@ class OthelloState(GridGameState):
     def __eq__(self, other):
         return super().__eq__(other) and self.active_player == other.active_player
 
-    def get_valid_moves(self) -> np.ndarray:
-        spaces = self.get_spaces()
-        moves = np.zeros(self.board_height * self.board_width + 1, bool)
-        move_spaces = moves[:-1].reshape(self.board_width, self.board_height)
-        player = self.get_active_player()
-        piece_type = self.piece_types.index(player)
-        for i, j in self.find_moves(spaces, piece_type):
-            move_spaces[i, j] = True
-
-        if moves.sum() == 0:
-            # No moves for this player, check opponent.
-            for _ in self.find_moves(spaces, 1-piece_type):
-                # Opponent has a move, pass is allowed.
-                moves[-1] = True
-                break
+    def __hash__(self):
+        return self.zobrist_key
 
+    def create_cursor(self) -> 'OthelloCursor':
+        return OthelloCursor(self)
+
+    def create_batch(
+            self,
+            states: typing.Sequence[GameState]) -> 'OthelloBatch':
+        return OthelloBatch.from_states(
+            typing.cast(typing.Sequence[OthelloState], states))
+
+    @property
+    def rules(self) -> OthelloRules:
+        return OthelloRules.get(self.geometry)
+
+    @classmethod
+    def find_move_permutation(cls,
+                              geometry: GridGeometry,
+                              space_permutation: np.ndarray) -> np.ndarray:
+        # Passing stays the last move.
+        return np.append(space_permutation, geometry.space_count)
+
+    def find_player_bitboards(self) -> typing.Tuple[int, int]:
+        """ Find the active player's pieces, then the opponent's pieces. """
+        piece_type = self.piece_types.index(self.active_player)
+        return self.bitboards[piece_type], self.bitboards[1 - piece_type]
+
+    def clear_memos(self):
+        super().clear_memos()
+        self._status = None
+
+    @memoized('_status')
+    def find_status(self) -> OthelloStatus:
+        """ Check moves, passing, and the end of the game together. """
+        x_bits, o_bits = self.bitboards
+        return self.rules.find_status(x_bits, o_bits, self.active_player)
+
+    @memoized('_valid_moves')
+    def get_valid_moves(self) -> np.ndarray:
+        status = self.find_status()
+        moves = np.zeros(self.geometry.space_count + 1, bool)
+        if status.move_spaces:
+            moves[:-1] = self.bits_to_array(status.move_spaces)
+        moves[-1] = status.is_pass_allowed
         return moves
 
-    def find_moves(self, spaces: np.ndarray, piece_type: int):
-        for i in range(self.board_height):
-            for j in range(self.board_width):
-                if spaces[piece_type, i, j]:
-                    yield from self.find_moves_from_space(spaces,
-                                                          i,
-                                                          j,
-                                                          piece_type)
-
-    def find_moves_from_space(self, spaces, start_row, start_column, piece_type):
-        for di in range(-1, 2):
-            for dj in range(-1, 2):
-                if not (di or dj):
-                    continue
-                has_flipped = False
-                i = start_row + di
-                j = start_column + dj
-                while 0 <= i < self.board_height and 0 <= j < self.board_width:
-                    if spaces[piece_type, i, j]:
-                        break
-                    if not spaces[1-piece_type, i, j]:
-                        # empty space
-                        if has_flipped:
-                            yield i, j
-                        break
-                    else:
-                        has_flipped = True
-                    i += di
-                    j += dj
+    @memoized('_valid_move_indices')
+    def get_valid_move_indices(self) -> np.ndarray:
+        return self.find_move_indices(self.find_status())
+
+    def find_move_indices(self, status: OthelloStatus) -> np.ndarray:
+        if status.is_pass_allowed:
+            return np.array([self.geometry.space_count], dtype=int)
+        return np.array(find_bit_indexes(status.move_spaces), dtype=int)
+
+    def step(self, move: int) -> Transition:
+        new_state = self.make_move(move)
+        # One pass of the move generator answers all the questions.
+        status = new_state.find_status()
+        return new_state.record_status(status.winner,
+                                       new_state.active_player,
+                                       new_state.find_move_indices(status),
+                                       status.is_ended)
 
     def display(self, show_coordinates: bool = False) -> str:
         result = super().display(show_coordinates)
@@ -105,66 +285,252 @@ class OthelloState(GridGameState):
         return super().parse_move(trimmed)
 
     def make_move(self, move: int) -> 'OthelloState':
+        move = int(move)
         new_state = copy(self)
         new_state.active_player = -self.active_player
+        zobrist_table = self.zobrist_table
+        new_key = self.zobrist_key ^ zobrist_table.side_key
 
-        if move == self.board_width * self.board_height:
-            return new_state  # It's a pass.
+        if move == self.geometry.space_count:
+            new_state._zobrist_key = new_key
+            new_state.last_space = None
+            return new_state.intern()  # It's a pass.
 
-        spaces = new_state.spaces
-        start_row = move // self.board_width
-        start_column = move % self.board_width
         piece_type = self.piece_types.index(self.active_player)
-        opponent_piece_type = 1 - piece_type
-        for di in range(-1, 2):
-            for dj in range(-1, 2):
-                if not (di or dj):
-                    continue
-                to_flip: typing.List[typing.Tuple[int, int]] = []  # [(i, j)]
-                i = start_row + di
-                j = start_column + dj
-                while 0 <= i < self.board_height and 0 <= j < self.board_width:
-                    if spaces[piece_type, i, j]:
-                        for i2, j2 in to_flip:
-                            spaces[opponent_piece_type, i2, j2] = 0
-                            spaces[piece_type, i2, j2] = 1
-                        break
-                    elif not spaces[opponent_piece_type, i, j]:
-                        # empty space
-                        break
-                    else:
-                        to_flip.append((i, j))
-                    i += di
-                    j += dj
-        spaces[piece_type, start_row, start_column] = 1
-        new_state.spaces = spaces
-        return new_state
+        player_bits, opponent_bits = self.find_player_bitboards()
+        flips = self.rules.find_flips(player_bits, opponent_bits, move)
+        bitboards = [0, 0]
+        bitboards[piece_type] = player_bits | flips | (1 << move)
+        bitboards[1 - piece_type] = opponent_bits & ~flips
+        new_state.bitboards = tuple(bitboards)
+
+        piece_keys = zobrist_table.piece_keys[piece_type]
+        opponent_keys = zobrist_table.piece_keys[1 - piece_type]
+        for flipped in find_bit_indexes(flips):
+            new_key ^= piece_keys[flipped] ^ opponent_keys[flipped]
+        new_state._zobrist_key = new_key ^ piece_keys[move]
+        new_state.last_space = move
+        return new_state.intern()
 
     def get_active_player(self):
         return self.active_player
 
+    def restore_active_player(self, player: int):
+        self.active_player = player
+
     def is_ended(self):
-        spaces = self.spaces
-        piece_type = self.piece_types.index(self.active_player)
-        for _ in self.find_moves(spaces, piece_type):
-            # Player has a move, not ended.
-            return False
-        for _ in self.find_moves(spaces, 1-piece_type):
-            # Opponent has a move, not ended.
-            return False
-        return True
+        return self.find_status().is_ended
 
     def get_winner(self):
-        if not self.is_ended():
-            return self.NO_PLAYER
-        spaces = self.spaces
-        x_total = spaces[0].sum()
-        o_total = spaces[1].sum()
-        if x_total > o_total:
-            return self.X_PLAYER
-        if x_total < o_total:
-            return self.O_PLAYER
-        return self.NO_PLAYER
+        return self.find_status().winner
 
     def is_win(self, player: int) -> bool:
         return self.get_winner() == player
+
+
+class OthelloCursor(BitboardCursor):
+    """ Cursor that flips pieces in place, and remembers them to undo. """
+    start_state: OthelloState
+
+    def __init__(self, start_state: OthelloState):
+        super().__init__(start_state)
+        self.rules = OthelloRules.get(self.geometry)
+        self.pass_move = self.geometry.space_count
+        self.flips: typing.List[int] = []  # [flipped_bits] for each move
+        self.status: OthelloStatus | None = None  # for the current position
+
+    def push(self, move: int):
+        move = int(move)
+        flips = 0
+        if move != self.pass_move:
+            piece_type = self.piece_types.index(self.player)
+            player_bits = self.bitboards[piece_type]
+            opponent_bits = self.bitboards[1 - piece_type]
+            flips = self.rules.find_flips(player_bits, opponent_bits, move)
+            self.bitboards[piece_type] = player_bits | flips | (1 << move)
+            self.bitboards[1 - piece_type] = opponent_bits & ~flips
+        self.spaces_played.append(move)
+        self.flips.append(flips)
+        self.player = -self.player
+        self.status = None
+
+    def pop(self):
+        move = self.spaces_played.pop()
+        flips = self.flips.pop()
+        self.player = -self.player
+        self.status = None
+        if move == self.pass_move:
+            return
+        piece_type = self.piece_types.index(self.player)
+        self.bitboards[piece_type] &= ~(flips | (1 << move))
+        self.bitboards[1 - piece_type] |= flips
+
+    def find_status(self) -> OthelloStatus:
+        """ Check moves, passing, and the end of the game together. """
+        status = self.status
+        if status is None:
+            x_bits, o_bits = self.bitboards
+            status = self.rules.find_status(x_bits, o_bits, self.player)
+            self.status = status
+        return status
+
+    def valid_moves(self) -> typing.Sequence[int]:
+        status = self.find_status()
+        if status.is_pass_allowed:
+            return [self.pass_move]
+        return find_bit_indexes(status.move_spaces)
+
+    def is_ended(self) -> bool:
+        return self.find_status().is_ended
+
+    def winner(self) -> int:
+        return self.find_status().winner
+
+    def is_win(self, player: int) -> bool:
+        return self.winner() == player
+
+    def get_state(self) -> OthelloState:
+        state = typing.cast(OthelloState, super().get_state())
+        state.active_player = self.player
+        return state
+
+
+class OthelloBatch(ArrayBatch):
+    """ Othello rules for many boards at once.
+
+    A move is valid when shifting a player's pieces one step at a time in
+    some direction crosses a run of opponent pieces and lands in an empty
+    space. To make moves, each board is coded as +1 for the active player's
+    pieces, -1 for the opponent's pieces, and 0 for empty spaces, then the
+    codes along the moves' rays in OthelloRules.ray_spaces show the runs to
+    flip.
+    """
+    template: OthelloState
+
+    @property
+    def rules(self) -> OthelloRules:
+        return self.template.rules
+
+    @staticmethod
+    def shift(boards: np.ndarray, di: int, dj: int) -> np.ndarray:
+        """ Move every space of each board by di rows and dj columns.
+
+        Spaces that move off the board are lost, and new spaces are False.
+        """
+        board_height, board_width = boards.shape[1:]
+        shifted = np.zeros_like(boards)
+        shifted[:,
+                max(di, 0):board_height + min(di, 0),
+                max(dj, 0):board_width + min(dj, 0)] = boards[
+            :,
+            max(-di, 0):board_height - max(di, 0),
+            max(-dj, 0):board_width - max(dj, 0)]
+        return shifted
+
+    def find_runs(self,
+                  start_boards: np.ndarray,
+                  opponent_boards: np.ndarray,
+                  di: int,
+                  dj: int) -> np.ndarray:
+        """ Find the opponent pieces in a line from each start space. """
+        runs = self.shift(start_boards, di, dj) & opponent_boards
+        max_size = max(self.template.board_height, self.template.board_width)
+        for _ in range(max_size - 3):
+            runs |= self.shift(runs, di, dj) & opponent_boards
+        return runs
+
+    def find_move_spaces(self,
+                         player_boards: np.ndarray,
+                         opponent_boards: np.ndarray) -> np.ndarray:
+        """ Find the spaces where each player could move. """
+        empty_boards = ~(player_boards | opponent_boards)
+        move_spaces = np.zeros_like(player_boards)
+        for di, dj in self.rules.DIRECTIONS:
+            runs = self.find_runs(player_boards, opponent_boards, di, dj)
+            move_spaces |= self.shift(runs, di, dj) & empty_boards
+        return move_spaces
+
+    def split_pieces(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """ Split the spaces into the active and inactive players' pieces. """
+        piece_types = self.find_piece_types(self.players)
+        pieces = self.spaces.astype(bool)
+        return (pieces[self.batch_indexes, piece_types],
+                pieces[self.batch_indexes, 1 - piece_types])
+
+    def find_codes(self) -> np.ndarray:
+        """ Code each space from the active player's point of view. """
+        player_boards, opponent_boards = self.split_pieces()
+        codes = np.zeros((len(self), self.template.geometry.space_count + 1),
+                         np.int8)
+        codes[:, :-1] = player_boards.reshape(len(self), -1)
+        codes[:, :-1] -= opponent_boards.reshape(len(self), -1)
+        return codes
+
+    @staticmethod
+    def measure_runs(
+            ray_codes: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """ Measure the run of opponent pieces at the start of each ray.
+
+        :param ray_codes: codes along each ray, with rays in the last axis
+        :return: (run_sizes, is_capped) where is_capped is True when the run
+            ends with one of the active player's pieces, so it would flip.
+        """
+        run_sizes = np.cumprod(ray_codes == -1, axis=-1).sum(axis=-1)
+        run_ends = np.take_along_axis(ray_codes,
+                                      run_sizes[..., np.newaxis],
+                                      axis=-1)[..., 0]
+        is_capped = (run_sizes > 0) & (run_ends == 1)
+        return run_sizes, is_capped
+
+    def valid_moves(self) -> np.ndarray:
+        player_boards, opponent_boards = self.split_pieces()
+        move_spaces = self.find_move_spaces(player_boards, opponent_boards)
+        moves = np.zeros((len(self), move_spaces[0].size + 1), dtype=bool)
+        moves[:, :-1] = move_spaces.reshape(len(self), -1)
+        has_moves = moves.any(axis=1)
+        opponent_moves = self.find_move_spaces(opponent_boards, player_boards)
+        # Pass is allowed if the opponent has a move.
+        moves[:, -1] = ~has_moves & opponent_moves.any(axis=(1, 2))
+        return moves
+
+    def make_moves(self, moves: typing.Sequence[int]) -> 'OthelloBatch':
+        move_indexes = np.asarray(moves)
+        codes = self.find_codes()
+        move_rays = self.rules.ray_spaces[move_indexes]
+        ray_codes = codes[self.batch_indexes[:, np.newaxis, np.newaxis],
+                          move_rays]
+        run_sizes, is_capped = self.measure_runs(ray_codes)
+        ray_positions = np.arange(move_rays.shape[-1])
+        is_flipped = ((ray_positions < run_sizes[..., np.newaxis]) &
+                      is_capped[..., np.newaxis])
+        board_indexes, directions, positions = np.nonzero(is_flipped)
+        codes[board_indexes,
+              move_rays[board_indexes, directions, positions]] = 1
+        # A pass just marks the padding space, which gets dropped.
+        codes[self.batch_indexes, move_indexes] = 1
+        piece_types = self.find_piece_types(self.players)
+        new_spaces = np.empty_like(self.spaces)
+        board_shape = (len(self),) + new_spaces.shape[2:]
+        new_spaces[self.batch_indexes, piece_types] = (
+            codes[:, :-1] == 1).reshape(board_shape)
+        new_spaces[self.batch_indexes, 1 - piece_types] = (
+            codes[:, :-1] == -1).reshape(board_shape)
+        return OthelloBatch(self.template, new_spaces, -self.players)
+
+    def is_ended(self) -> np.ndarray:
+        player_boards, opponent_boards = self.split_pieces()
+        player_moves = self.find_move_spaces(player_boards, opponent_boards)
+        opponent_moves = self.find_move_spaces(opponent_boards, player_boards)
+        return np.asarray(~(player_moves.any(axis=(1, 2)) |
+                            opponent_moves.any(axis=(1, 2))))
+
+    def winners(self) -> np.ndarray:
+        counts = self.spaces.sum(axis=(2, 3), dtype=int)
+        x_player, o_player = self.template.piece_types
+        winners = np.sign(counts[:, 0] - counts[:, 1]) * x_player
+        return np.where(self.is_ended(), winners, OthelloState.NO_PLAYER)
+
+    def get_state(self, index: int) -> OthelloState:
+        state = typing.cast(OthelloState, super().get_state(index))
+        state.active_player = int(self.players[index])
+        return state
@@ -22,17 +22,17 @@ class Playout(Heuristic):
         :return: 1 if the start_state's active player won the game, -1 for a
             loss, and 0 for a draw
         """
-        current_state = start_state
-        multiplier = 1
-        while True:
-            if current_state.is_ended():
-                value, policy = self.analyse_end_game(current_state)
-                return multiplier*value
-            valid_moves, = np.nonzero(current_state.get_valid_moves())
+        cursor = start_state.create_cursor()
+        start_player = cursor.active_player()
+        while not cursor.is_ended():
+            valid_moves = cursor.valid_moves()
             if len(valid_moves) == 0:
-                raise ValueError('No valid moves found.\n' + current_state.display())
-            move = np.random.choice(valid_moves)
-            new_state = current_state.make_move(move)
-            if new_state.get_active_player() != current_state.get_active_player():
-                multiplier *= -1
-            current_state = new_state
+                raise ValueError('No valid moves found.\n' +
+                                 cursor.get_state().display())
+            cursor.push(valid_moves[np.random.randint(len(valid_moves))])
+        winner = cursor.winner()
+        if winner == start_state.NO_PLAYER:
+            return 0
+        if winner == start_player:
+            return 1
+        return -1
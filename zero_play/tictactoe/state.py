@@ -1,11 +1,21 @@
+import typing
+from functools import cache
+
 import numpy as np
 
-from zero_play.game_state import GridGameState
+from zero_play.game_state import (BitboardGameState, BitboardCursor,
+                                  ArrayBatch, LineRules, GameCursor,
+                                  GameState, Transition)
 
 
-class TicTacToeState(GridGameState):
+class TicTacToeState(BitboardGameState):
+    __slots__ = ()
     game_name = 'Tic Tac Toe'
 
+    # Number of pieces in a row that win, or None for a full row.
+    win_length: int | None = None
+    symmetry = 'dihedral'
+
     def __init__(self,
                  text: str | None = None,
                  spaces: np.ndarray | None = None,
@@ -16,35 +26,287 @@ class TicTacToeState(GridGameState):
                          text=text,
                          spaces=spaces)
 
+    @property
+    def line_rules(self) -> LineRules:
+        win_length = self.win_length
+        if win_length is None:
+            win_length = min(self.board_height, self.board_width)
+        return LineRules.get(self.board_height, self.board_width, win_length)
+
+    def create_cursor(self) -> GameCursor:
+        return TicTacToeCursor(self)
+
+    def create_batch(
+            self,
+            states: typing.Sequence[GameState]) -> 'TicTacToeBatch':
+        return TicTacToeBatch.from_states(
+            typing.cast(typing.Sequence[TicTacToeState], states))
+
+    def is_win(self, player: int) -> bool:
+        """ Has the given player collected a line in any direction? """
+        piece_type = self.piece_types.index(player)
+        return self.line_rules.has_line(self.bitboards[piece_type])
+
+    def is_win_through(self, player: int, space: int) -> bool:
+        piece_type = self.piece_types.index(player)
+        return self.line_rules.has_line_through(self.bitboards[piece_type],
+                                                space)
+
+    def step(self, move: int) -> Transition:
+        new_state = self.make_move(move)
+        # Every space but the new piece's stays open, and players alternate.
+        move_indices = self.get_valid_move_indices()
+        return new_state.record_status(new_state.get_winner(),
+                                       -self.get_active_player(),
+                                       move_indices[move_indices != move])
+
+
+class FiveInARowState(TicTacToeState):
+    """ Tic Tac Toe on a bigger board, where five in a row wins.
+
+    This is mostly useful to see how search speed changes with board size.
+    """
+    __slots__ = ()
+    game_name = 'Five in a Row'
+    win_length = 5
+
+    def __init__(self,
+                 text: str | None = None,
+                 spaces: np.ndarray | None = None,
+                 board_height: int = 15,
+                 board_width: int = 15):
+        super().__init__(text=text,
+                         spaces=spaces,
+                         board_height=board_height,
+                         board_width=board_width)
+
+
+class TicTacToeTable:
+    """ Every Tic Tac Toe position that moves can reach, with answers to all
+    the rules questions already worked out.
+
+    Positions are numbered from 0 for the empty board, and each one has its
+    valid moves, the position after each move, the winner, and whether the
+    game has ended. This also covers moves after a win, because
+    TicTacToeState allows them, so there are more positions here than the
+    5478 in complete games.
+    Use get() to build the shared instance the first time it's needed.
+    """
+    def __init__(self):
+        start_state = TicTacToeState()
+        states = [start_state]
+        self.indexes = {start_state.bitboards: 0}  # {bitboards: index}
+        successor_lists = []
+        for state in states:  # Grows as new positions are found.
+            successors = [-1] * start_state.geometry.space_count
+            for move in np.flatnonzero(state.get_valid_moves()).tolist():
+                child = state.make_move(move)
+                index = self.indexes.setdefault(child.bitboards, len(states))
+                if index == len(states):
+                    states.append(child)
+                successors[move] = index
+            successor_lists.append(tuple(successors))
+
+        # Python sequences for looking up one position at a time.
+        self.bitboards = tuple(state.bitboards for state in states)
+        self.zobrist_keys = tuple(state.zobrist_key for state in states)
+        self.successor_lists = tuple(successor_lists)
+        self.move_lists = tuple(
+            tuple(move for move, successor in enumerate(successors)
+                  if successor >= 0)
+            for successors in successor_lists)
+        self.move_arrays = tuple(self.build_array(moves, int)
+                                 for moves in self.move_lists)
+        self.winner_list = tuple(state.get_winner() for state in states)
+        self.is_ended_list = tuple(state.is_ended() for state in states)
+        self.active_player_list = tuple(state.get_active_player()
+                                        for state in states)
+
+        # Arrays for looking up many positions at once.
+        self.successors = self.build_array(successor_lists, np.int16)
+        self.valid_moves = self.build_array(
+            [state.get_valid_moves() for state in states], bool)
+        self.winners = self.build_array(self.winner_list, np.int8)
+        self.is_ended = self.build_array(self.is_ended_list, bool)
+        self.active_players = self.build_array(self.active_player_list,
+                                               np.int8)
+
+        self.table_states: typing.List[TicTacToeTableState | None] = [
+            None] * len(states)
+        self.transitions: typing.List[Transition | None] = [None] * len(states)
+
+    def __len__(self):
+        return len(self.bitboards)
+
+    @staticmethod
+    @cache
+    def get() -> 'TicTacToeTable':
+        """ Get the shared instance, building it the first time. """
+        return TicTacToeTable()
+
+    @staticmethod
+    def build_array(values: typing.Sequence, dtype) -> np.ndarray:
+        array = np.array(values, dtype=dtype)
+        array.flags.writeable = False
+        return array
+
+    def find_index(self, bitboards: typing.Tuple[int, ...]) -> int:
+        try:
+            return self.indexes[bitboards]
+        except KeyError:
+            raise ValueError('Position is not reachable.') from None
+
+    def get_state(self, index: int) -> 'TicTacToeTableState':
+        """ Get the shared state object for a position. """
+        state = self.table_states[index]
+        if state is None:
+            if index == 0:
+                state = TicTacToeTableState()
+            else:
+                start_state = self.get_state(0)
+                state = typing.cast(
+                    TicTacToeTableState,
+                    start_state.with_bitboards(self.bitboards[index]))
+                state.index = index
+            state._zobrist_key = self.zobrist_keys[index]
+            self.table_states[index] = state
+        return state
+
+    def get_transition(self, index: int) -> Transition:
+        """ Get the shared transition to a position. """
+        transition = self.transitions[index]
+        if transition is None:
+            transition = self.transitions[index] = Transition(
+                self.get_state(index),
+                self.is_ended_list[index],
+                self.winner_list[index],
+                self.active_player_list[index],
+                self.move_arrays[index])
+        return transition
+
+
+class TicTacToeTableState(TicTacToeState):
+    """ Tic Tac Toe that looks up all the rules in TicTacToeTable.
+
+    This only plays on a 3x3 board, and it shows how fast searches can be
+    when the rules cost almost nothing. States made by make_move() are
+    shared, one for each position.
+    """
+    __slots__ = ('index',)
+
+    def __init__(self,
+                 text: str | None = None,
+                 spaces: np.ndarray | None = None):
+        super().__init__(text=text, spaces=spaces)
+
+    @property
+    def table(self) -> TicTacToeTable:
+        return TicTacToeTable.get()
+
+    def pack_spaces(self, spaces: np.ndarray):
+        super().pack_spaces(spaces)
+        self.index = self.table.find_index(self.bitboards)
+
+    def unpack_board(self, data: bytes) -> 'TicTacToeTableState':
+        bitboards = super().unpack_board(data).bitboards
+        return self.table.get_state(self.table.find_index(bitboards))
+
+    def create_cursor(self) -> 'TicTacToeTableCursor':
+        return TicTacToeTableCursor(self)
+
+    def get_valid_moves(self) -> np.ndarray:
+        return self.table.valid_moves[self.index]
+
+    def get_valid_move_indices(self) -> np.ndarray:
+        return self.table.move_arrays[self.index]
+
+    def get_move_count(self) -> int:
+        return sum(bits.bit_count() for bits in self.bitboards)
+
+    def get_active_player(self) -> int:
+        return self.table.active_player_list[self.index]
+
+    def get_winner(self) -> int:
+        return self.table.winner_list[self.index]
+
+    def is_ended(self) -> bool:
+        return self.table.is_ended_list[self.index]
+
+    def make_move(self, move: int) -> 'TicTacToeTableState':
+        # The table only holds TicTacToeTableState objects.
+        return typing.cast(TicTacToeTableState, self.step(move).state)
+
+    def step(self, move: int) -> Transition:
+        table = self.table
+        successor = table.successor_lists[self.index][move]
+        if successor < 0:
+            raise ValueError(f'Invalid move: {move}.')
+        return table.get_transition(successor)
+
+
+class TicTacToeTableCursor(GameCursor):
+    """ Cursor that keeps a stack of position numbers in TicTacToeTable. """
+    def __init__(self, start_state: TicTacToeTableState):
+        self.table = start_state.table
+        self.indexes = [start_state.index]
+
+    @property
+    def depth(self) -> int:
+        return len(self.indexes) - 1
+
+    def push(self, move: int):
+        successor = self.table.successor_lists[self.indexes[-1]][move]
+        if successor < 0:
+            raise ValueError(f'Invalid move: {move}.')
+        self.indexes.append(successor)
+
+    def pop(self):
+        if len(self.indexes) == 1:
+            raise IndexError('No moves to pop.')
+        self.indexes.pop()
+
+    def valid_moves(self) -> typing.Sequence[int]:
+        return self.table.move_lists[self.indexes[-1]]
+
+    def winner(self) -> int:
+        return self.table.winner_list[self.indexes[-1]]
+
+    def active_player(self) -> int:
+        return self.table.active_player_list[self.indexes[-1]]
+
+    def is_ended(self) -> bool:
+        return self.table.is_ended_list[self.indexes[-1]]
+
+    def get_state(self) -> TicTacToeTableState:
+        return self.table.get_state(self.indexes[-1])
+
+
+class TicTacToeCursor(BitboardCursor):
+    start_state: TicTacToeState
+
+    def __init__(self, start_state: TicTacToeState):
+        super().__init__(start_state)
+        self.line_rules = start_state.line_rules
+
     def is_win(self, player: int) -> bool:
-        """ Has the given player collected a triplet in any direction? """
         piece_type = self.piece_types.index(player)
-        size = self.board_width
-        player_pieces = self.get_spaces()[piece_type]
-        # check horizontal lines
-        for i in range(size):
-            count = 0
-            for j in range(size):
-                if player_pieces[i, j]:
-                    count += 1
-            if count == size:
-                return True
-        # check vertical lines
-        for j in range(size):
-            count = 0
-            for i in range(size):
-                if player_pieces[i, j]:
-                    count += 1
-            if count == size:
-                return True
-        # check two diagonal strips
-        count1 = count2 = 0
-        for d in range(size):
-            if player_pieces[d, d]:
-                count1 += 1
-            if player_pieces[d, size - d - 1]:
-                count2 += 1
-        if count1 == size or count2 == size:
-            return True
-
-        return False
+        return self.line_rules.has_line(self.bitboards[piece_type])
+
+    def is_win_through(self, player: int, space: int) -> bool:
+        piece_type = self.piece_types.index(player)
+        return self.line_rules.has_line_through(self.bitboards[piece_type],
+                                                space)
+
+
+class TicTacToeBatch(ArrayBatch):
+    template: TicTacToeState
+
+    def valid_moves(self) -> np.ndarray:
+        return (self.spaces.sum(axis=1) == 0).reshape(len(self), -1)
+
+    def make_moves(self, moves: typing.Sequence[int]) -> 'TicTacToeBatch':
+        new_spaces = self.place_pieces(np.asarray(moves))
+        return TicTacToeBatch(self.template, new_spaces, -self.players)
+
+    def winners(self) -> np.ndarray:
+        return self.find_line_winners(self.template.line_rules.line_spaces)
@@ -1,9 +1,17 @@
+import pickle
+import tracemalloc
+import typing
+from time import perf_counter
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from importlib import import_module
 
-from zero_play.game_state import GameState
-from zero_play.mcts_player import MctsPlayer
+import numpy as np
+
+from zero_play.game_state import GameState, GridGameState
+from zero_play.heuristic import Heuristic
+from zero_play.mcts_player import MctsPlayer, SearchManager
 from zero_play.play_controller import PlayController
+from zero_play.playout import Playout
 
 
 def parse_args():
@@ -39,12 +47,203 @@ def parse_args():
                         type=int,
                         default=1,
                         help='Number of parallel search processes for player 2.')
+    parser.add_argument('--array-tree',
+                        action='store_true',
+                        help='Store search nodes in arrays, instead of '
+                             'SearchNode objects.')
+    parser.add_argument('--transpositions',
+                        action='store_true',
+                        help='Share search nodes between move orders that '
+                             'reach the same position.')
+    parser.add_argument('--max-nodes',
+                        type=int,
+                        help='Evict the least visited search nodes after '
+                             'each search, to keep at most this many.')
     parser.add_argument('--display',
                         action='store_true',
                         help='Display moves in the games.')
+    parser.add_argument('--memory',
+                        type=int,
+                        metavar='ITERATIONS',
+                        help='Instead of playing games, measure the memory '
+                             'used by each search node after a search with '
+                             'this many iterations.')
+    parser.add_argument('--scaling',
+                        type=int,
+                        metavar='ITERATIONS',
+                        help='Instead of playing games, measure search speed '
+                             'with this many iterations on square boards from '
+                             '5x5 up to 15x15.')
+    parser.add_argument('--tree',
+                        type=int,
+                        metavar='ITERATIONS',
+                        help='Instead of playing games, measure the speed of '
+                             'selection and backpropagation alone, with a '
+                             'heuristic that scores every position as a '
+                             'draw.')
+    parser.add_argument('--ipc',
+                        type=int,
+                        metavar='ITERATIONS',
+                        help='Instead of playing games, compare the cost of '
+                             'sending positions to worker processes as '
+                             'pickles or bytes, using the nodes from a search '
+                             'with this many iterations.')
+    parser.add_argument('--merge',
+                        type=int,
+                        metavar='ITERATIONS',
+                        help='Instead of playing games, compare searches with '
+                             'and without transpositions, up to this many '
+                             'iterations from the start position.')
     return parser.parse_args()
 
 
+class DrawHeuristic(Heuristic):
+    """ Score every position as a draw, so searches only cost tree work. """
+    def get_summary(self) -> typing.Sequence[str]:
+        return 'draw',
+
+    def analyse(self, board: GameState) -> typing.Tuple[float, np.ndarray]:
+        return 0, self.create_even_policy(board)
+
+
+def measure_memory(start_state: GameState, iterations: int) -> None:
+    """ Report the memory used per node in a search tree. """
+    tracemalloc.start()
+    search_manager = SearchManager(start_state, Playout())
+    start_size, _ = tracemalloc.get_traced_memory()
+    search_manager.search(start_state, iterations)
+    end_size, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    node_count = 0
+    pending_nodes = [search_manager.current_node]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        node_count += 1
+        pending_nodes.extend(node.children or ())
+    node_size = (end_size - start_size) / node_count
+    print(f'{node_count} nodes after {iterations} iterations, '
+          f'{node_size:0.0f} bytes/node, '
+          f'{(peak_size - start_size)/1024:0.0f} KiB peak')
+
+
+def measure_scaling(game_state_class: type, iterations: int) -> None:
+    """ Report how search speed changes with board size. """
+    for board_size in range(5, 16, 2):
+        start_state = game_state_class(board_height=board_size,
+                                       board_width=board_size)
+        search_manager = SearchManager(start_state, Playout())
+        start_time = perf_counter()
+        search_manager.search(start_state, iterations)
+        duration = perf_counter() - start_time
+        print(f'{board_size}x{board_size}: '
+              f'{iterations/duration:0.0f} iterations/s')
+
+
+def measure_tree(start_state: GameState,
+                 iterations: int,
+                 use_array_tree: bool) -> None:
+    """ Report the speed of the search tree, without any rollouts. """
+    search_manager = SearchManager(start_state,
+                                   DrawHeuristic(),
+                                   use_array_tree=use_array_tree)
+    start_time = perf_counter()
+    search_manager.search(start_state, iterations)
+    duration = perf_counter() - start_time
+
+    max_depth = 0
+    pending_nodes = [(search_manager.current_node, 0)]
+    while pending_nodes:
+        node, depth = pending_nodes.pop()
+        max_depth = max(max_depth, depth)
+        pending_nodes.extend((child, depth+1) for child in node.children or ())
+    print(f'{iterations/duration:0.0f} iterations/s, tree depth {max_depth}')
+
+
+def measure_ipc(start_state: GameState, iterations: int) -> None:
+    """ Report the size and time to send a search task's position. """
+    search_manager = SearchManager(start_state, Playout())
+    search_manager.search(start_state, iterations)
+    states = []
+    pending_nodes = [search_manager.current_node]
+    while pending_nodes:
+        node = pending_nodes.pop()
+        states.append(node.game_state)
+        pending_nodes.extend(node.children or ())
+
+    start_time = perf_counter()
+    pickles = [pickle.dumps(state) for state in states]
+    for data in pickles:
+        pickle.loads(data)
+    pickle_duration = perf_counter() - start_time
+
+    start_time = perf_counter()
+    byte_strings = [state.to_bytes() for state in states]
+    for data in byte_strings:
+        start_state.from_bytes(data)
+    bytes_duration = perf_counter() - start_time
+
+    for name, messages, duration in (('pickle', pickles, pickle_duration),
+                                     ('bytes', byte_strings, bytes_duration)):
+        message_size = sum(len(data) for data in messages) / len(messages)
+        print(f'{name}: {message_size:0.0f} bytes/task, '
+              f'{duration/len(messages)*1e6:0.1f} us/task')
+
+
+def measure_merges(start_state: GameState,
+                   iterations: int,
+                   search_count: int = 10,
+                   step_size: int = 10) -> None:
+    """ Report how transpositions change the search from the start position.
+
+    Each search runs in steps, and the settled count is the number of
+    iterations after which the most visited move stopped changing.
+    """
+    for use_transpositions in (False, True):
+        np.random.seed(0)
+        settled_counts = []
+        node_counts = []
+        merge_rates = []
+        for _ in range(search_count):
+            search_manager = SearchManager(
+                start_state,
+                Playout(),
+                use_transpositions=use_transpositions)
+            root = search_manager.current_node
+            best_move = None
+            settled_count = 0
+            for iteration in range(step_size, iterations+1, step_size):
+                search_manager.search(start_state, step_size)
+                assert root.child_value_counts is not None
+                assert root.child_moves is not None
+                new_best_move = root.child_moves[
+                    root.child_value_counts.argmax()]
+                if new_best_move != best_move:
+                    best_move = new_best_move
+                    settled_count = iteration
+            settled_counts.append(settled_count)
+
+            nodes = {id(root): root}
+            pending_nodes = [root]
+            while pending_nodes:
+                node = pending_nodes.pop()
+                for child in node.children or ():
+                    if id(child) not in nodes:
+                        nodes[id(child)] = child
+                        pending_nodes.append(child)
+            node_counts.append(len(nodes))
+            if search_manager.transpositions is not None:
+                merge_rates.append(search_manager.transpositions.merge_rate)
+        if merge_rates:
+            merge_text = f', {np.mean(merge_rates):0.1%} merged'
+        else:
+            merge_text = ''
+        print(f'transpositions={use_transpositions}: '
+              f'{np.mean(node_counts):0.0f} nodes{merge_text}, '
+              f'best move settled after {np.mean(settled_counts):0.0f} '
+              f'iterations')
+
+
 def main() -> None:
     args = parse_args()
     class_path = args.game
@@ -54,11 +253,48 @@ def main() -> None:
     module = import_module(module_name)
     game_state_class = getattr(module, class_name)
     start_state: GameState = game_state_class()
+    if args.memory is not None:
+        measure_memory(start_state, args.memory)
+        return
+    if args.tree is not None:
+        measure_tree(start_state, args.tree, args.array_tree)
+        return
+    if args.ipc is not None:
+        measure_ipc(start_state, args.ipc)
+        return
+    if args.merge is not None:
+        measure_merges(start_state, args.merge)
+        return
+    if args.scaling is not None:
+        measure_scaling(game_state_class, args.scaling)
+        return
 
-    player1 = MctsPlayer(start_state, milliseconds=args.iter1, process_count=args.processes1)
-    player2 = MctsPlayer(start_state, milliseconds=args.iter2, process_count=args.processes2)
+    player1 = MctsPlayer(start_state,
+                         milliseconds=args.iter1,
+                         process_count=args.processes1,
+                         use_array_tree=args.array_tree,
+                         use_transpositions=args.transpositions,
+                         max_nodes=args.max_nodes)
+    player2 = MctsPlayer(start_state,
+                         milliseconds=args.iter2,
+                         process_count=args.processes2,
+                         use_array_tree=args.array_tree,
+                         use_transpositions=args.transpositions,
+                         max_nodes=args.max_nodes)
+    if isinstance(start_state, GridGameState):
+        game_state_class.count_memos = True
     controller = PlayController(start_state, [player1, player2])
     controller.play(args.game_count, args.flip, args.display)
+    for player in (player1, player2):
+        iteration_rate = (player.average_iterations /
+                          player.average_milliseconds * 1000)
+        print(f'{", ".join(player.get_summary())} - '
+              f'{iteration_rate:0.0f} iterations/s, '
+              f'{player.average_inherited_visits:0.0f} visits inherited')
+    if isinstance(start_state, GridGameState):
+        hit_rates = start_state.get_memo_hit_rates()
+        for method_name, hit_rate in hit_rates.items():
+            print(f'{method_name}: {hit_rate:0.0%} cache hits')
 
 
 if __name__ == '__main__':